@@ -0,0 +1,573 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import bots
+import connection
+import journal
+import keyword_db
+import keyword_selector
+import loadgen
+import matchmaking
+import timer_wheel
+from connection import Connection
+from protocol import MessageType, encode
+from protocol import Message
+from server import GameRoom, KeywordRound, Player
+from spectators import SpectatorFeed
+
+# Benchmarks for the server hot paths.
+# Every result is a time in seconds (lower is better), stored under a dotted
+# metric name in a JSON file. Compare two result files with --compare to
+# catch regressions between commits.
+
+DB_SIZES = (1000, 10000, 100000)
+KEYWORD_LENGTHS = (10, 100, 1000)
+FANOUT_SIZES = (2, 16, 128, 1024)
+SPECTATOR_SIZES = (100, 1000, 3000)
+JOURNAL_RECORDS = 1000000
+MATCHMAKING_PLAYERS = 100000
+MATCHMAKING_ARRIVAL_RATE = 2000  # players per second
+MATCHMAKING_ROOM_SIZES = (2, 4)
+BOT_ROUNDS = 200
+BOT_GAMES = 200
+GUI_SIZE = (1280, 720)
+GUI_GAMES = 10
+GUI_IDLE_FRAMES = 500
+TIMER_TICK = 0.01
+TIMER_SLOTS = 64
+TIMER_CHAIN = 50
+REPEATS = 5
+
+# Best of several runs, which is the most stable estimate on a busy machine
+def best_of(func, repeats=REPEATS, number=1):
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+def write_text_database(path, size, rng):
+    with open(path, "w") as file:
+        file.write("{}\n".format(size))
+        for i in range(size):
+            length = rng.randint(4, 16)
+            file.write("{}{}\n".format("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(length)), i))
+            file.write("Description of keyword number {}\n".format(i))
+
+def bench_database(results, args, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        for size in DB_SIZES:
+            source = os.path.join(directory, "db{}.txt".format(size))
+            write_text_database(source, size, rng)
+
+            results["db.compile.{}".format(size)] = best_of(lambda: keyword_db.compile_database(source), repeats=3)
+
+            def cold_load():
+                keyword_db._cache.pop(source, None)
+                keyword_db.read_database(source)
+            results["db.load_cold.{}".format(size)] = best_of(cold_load)
+            results["db.load_cached.{}".format(size)] = best_of(lambda: keyword_db.read_database(source), number=1000)
+
+            database = keyword_db.read_database(source)
+            indexes = [rng.randrange(size) for _ in range(1000)]
+            results["db.random_entry.{}".format(size)] = best_of(lambda: [database[i] for i in indexes]) / len(indexes)
+
+            # Keyword selection: building the shared pool, then per-draw cost
+            def build_pool():
+                keyword_selector._pools.pop(database, None)
+                keyword_selector.get_pool(database)
+            results["select.pool.{}".format(size)] = best_of(build_pool, repeats=3)
+            selector = keyword_selector.KeywordSelector(database, rng=random.Random(args.seed))
+            results["select.shuffle_bag.{}".format(size)] = best_of(lambda: [selector.draw() for _ in range(1000)]) / 1000
+            table = keyword_selector.AliasTable([rng.random() for _ in range(size)])
+            sample_rng = random.Random(args.seed)
+            results["select.alias.{}".format(size)] = best_of(lambda: [table.sample(sample_rng) for _ in range(1000)]) / 1000
+            keyword_db._cache.pop(source, None)
+
+def bench_guesses(results, args, rng):
+    for length in KEYWORD_LENGTHS:
+        words = []
+        while sum(len(word) + 1 for word in words) < length:
+            words.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))))
+        keyword = " ".join(words)[:length]
+
+        results["guess.new_round.{}".format(length)] = best_of(lambda: KeywordRound(keyword), number=100)
+
+        # Guess every letter of the alphabet, which always solves the round
+        def guess_all():
+            keyword_round = KeywordRound(keyword)
+            for character in "etaoinshrdlcumwfgypbvkjxqz":
+                if not keyword_round.is_guessed(character):
+                    keyword_round.guess_character(character)
+                    keyword_round.is_solved()
+                    keyword_round.masked_word()
+        results["guess.character.{}".format(length)] = best_of(guess_all, number=20) / 26
+
+        keyword_round = KeywordRound(keyword)
+        guess = keyword.upper()
+        results["guess.keyword.{}".format(length)] = best_of(lambda: keyword_round.matches(guess), number=1000)
+
+async def bench_fanout_async(results):
+    for size in FANOUT_SIZES:
+        room = GameRoom(0, size, 5)
+        peers = []
+        for i in range(size):
+            ours, theirs = socket.socketpair()
+            peers.append(theirs)
+            room.players.append(Player(Connection(ours, None), None, "p{}".format(i)))
+
+        # Time to encode and queue one broadcast, then until every socket has been written
+        queue_times = []
+        total_times = []
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            room.broadcast(MessageType.CHARACTER_FOUND, "a", 3, "*a**a***a*")
+            queued = time.perf_counter()
+            await asyncio.sleep(0)
+            while any(player.conn.stats.bytes_pending for player in room.players):
+                await asyncio.sleep(0)
+            total_times.append(time.perf_counter() - started)
+            queue_times.append(queued - started)
+            for peer in peers:
+                peer.recv(65536)
+
+        results["broadcast.queue.{}".format(size)] = min(queue_times)
+        results["broadcast.flush.{}".format(size)] = min(total_times)
+        for player in room.players:
+            player.conn.close()
+        for peer in peers:
+            peer.close()
+
+def bench_fanout(results, args, rng):
+    asyncio.run(bench_fanout_async(results))
+
+async def bench_spectators_async(results):
+    events = [encode(MessageType.YOUR_TURN, "player"), encode(MessageType.CHARACTER_FOUND, "a", 3, "*a**a***a*")]
+    for size in SPECTATOR_SIZES:
+        feed = SpectatorFeed(lambda: ("playing", "", "", "", "", []), interval=0)
+        conns = []
+        peers = []
+        for _ in range(size):
+            ours, theirs = socket.socketpair()
+            theirs.setblocking(False)
+            peers.append(theirs)
+            conns.append(Connection(ours, None))
+            feed.add(conns[-1])
+        feed.flush()
+
+        # Time from publishing a turn's events until every spectator's socket has them
+        times = []
+        for _ in range(REPEATS):
+            await asyncio.sleep(0)
+            for peer in peers:
+                peer.recv(65536)
+            target = conns[-1].stats.bytes_queued + sum(len(event) for event in events)
+            started = time.perf_counter()
+            for event in events:
+                feed.publish(event)
+            feed.flush()
+            while conns[-1].stats.bytes_queued < target or connection.outbound_totals.bytes_pending:
+                await asyncio.sleep(0)
+            times.append(time.perf_counter() - started)
+
+        results["spectators.fanout.{}".format(size)] = min(times)
+        feed.close()
+        await asyncio.sleep(0)
+        for peer in peers:
+            peer.close()
+
+def bench_spectators(results, args, rng):
+    loadgen.raise_file_limit()
+    asyncio.run(bench_spectators_async(results))
+
+def bench_journal(results, args, rng):
+    guesses = [("player{}".format(i % 8), rng.choice("abcdefghijklmnopqrstuvwxyz"), MessageType.CHARACTER_MISSING)
+               for i in range(1000)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.journal")
+
+        # Cost of recording a guess on the event loop
+        log = journal.Journal(path)
+        def record_guesses():
+            for nickname, guess, result in guesses:
+                log.record(journal.RecordType.GUESS, 1, nickname, guess, result)
+        results["journal.record"] = best_of(record_guesses) / len(guesses)
+        log.close()
+
+        # Scanning a large journal, with and without decoding every record
+        with open(path, "wb") as file:
+            file.write(journal.FILE_HEADER.pack(journal.MAGIC, journal.VERSION))
+            chunk = b"".join(journal.encode_record(journal.RecordType.GUESS, i % 100, *guesses[i])
+                             for i in range(len(guesses)))
+            for _ in range(JOURNAL_RECORDS // len(guesses)):
+                file.write(chunk)
+        reader = journal.JournalReader(path)
+        results["journal.scan"] = best_of(lambda: sum(1 for _ in reader.scan(decode=False)), repeats=3) / JOURNAL_RECORDS
+        results["journal.replay"] = best_of(lambda: sum(1 for _ in reader.scan()), repeats=3) / JOURNAL_RECORDS
+        reader.close()
+
+# Players arrive at a steady rate with ratings spread around an average
+# player, on a simulated clock so the wait times do not depend on the machine.
+# Reports the real cost per matched player and the simulated waits.
+def bench_matchmaking(results, args, rng):
+    ratings = [max(0.0, rng.gauss(2.0, 1.0)) for _ in range(MATCHMAKING_PLAYERS)]
+    step = 1.0 / MATCHMAKING_ARRIVAL_RATE
+    for room_size in MATCHMAKING_ROOM_SIZES:
+        def run():
+            matcher = matchmaking.Matchmaker(room_size)
+            next_pass = matchmaking.MATCH_INTERVAL
+            for i, rating in enumerate(ratings):
+                now = i * step
+                if now >= next_pass:
+                    matcher.match(now)
+                    next_pass += matchmaking.MATCH_INTERVAL
+                matcher.add(i, rating, now)
+            # Let the stragglers time out into a room
+            now = len(ratings) * step
+            while matcher.waiting >= room_size:
+                now += matchmaking.MATCH_INTERVAL
+                matcher.match(now)
+            return matcher
+        matcher = run()
+        results["matchmaking.per_player.{}".format(room_size)] = best_of(run, repeats=3) / matcher.matched
+        results["matchmaking.wait_p50.{}".format(room_size)] = matcher.wait_percentile(0.5)
+        results["matchmaking.wait_p99.{}".format(room_size)] = matcher.wait_percentile(0.99)
+
+# How late a one-tick timer fires, scheduled from outside the wheel and from
+# inside a timer callback (as a room does when a timeout moves the turn on).
+# Both should be within a tick; a timer landing in the slot being emptied
+# would fire a whole revolution late. Then a callback that raises: the timers
+# sharing its tick and those after it must still fire, or the suite fails.
+async def bench_timers_async(results):
+    wheel = timer_wheel.TimerWheel(TIMER_TICK, TIMER_SLOTS)
+    wheel.start()
+    loop = asyncio.get_running_loop()
+    for name, chained in (("direct", False), ("chained", True)):
+        lateness = []
+        done = loop.create_future()
+
+        def fire(scheduled_at, left):
+            lateness.append(loop.time() - scheduled_at - TIMER_TICK)
+            if not left:
+                done.set_result(None)
+            elif chained:
+                wheel.schedule(TIMER_TICK, lambda now=loop.time(): fire(now, left - 1))
+            else:
+                loop.call_soon(lambda: wheel.schedule(TIMER_TICK, lambda now=loop.time(): fire(now, left - 1)))
+        wheel.schedule(TIMER_TICK, lambda now=loop.time(): fire(now, TIMER_CHAIN - 1))
+        await done
+        results["timers.lateness_max.{}".format(name)] = max(lateness)
+
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context["exception"]))
+    lateness = []
+    done = loop.create_future()
+
+    def fail():
+        raise RuntimeError("timer callback failed")
+
+    def fired(scheduled_at, delay, last):
+        lateness.append(loop.time() - scheduled_at - delay)
+        if last:
+            done.set_result(None)
+    scheduled_at = loop.time()
+    wheel.schedule(TIMER_TICK, fail)
+    wheel.schedule(TIMER_TICK, lambda: fired(scheduled_at, TIMER_TICK, False))
+    wheel.schedule(5 * TIMER_TICK, lambda: fired(scheduled_at, 5 * TIMER_TICK, True))
+    try:
+        await asyncio.wait_for(done, 1.0)
+    except asyncio.TimeoutError:
+        raise RuntimeError("timer wheel stopped after a callback raised") from None
+    finally:
+        loop.set_exception_handler(None)
+    if len(errors) != 1 or len(lateness) != 2:
+        raise RuntimeError("timer callback error not reported once: {} errors, {} timers fired".format(len(errors), len(lateness)))
+    results["timers.lateness_max.after_error"] = max(lateness)
+    wheel.stop()
+
+    wheel = timer_wheel.TimerWheel()
+    results["timers.schedule_cancel"] = best_of(lambda: wheel.schedule(30.0, None).cancel(), number=100000)
+
+def bench_timers(results, args, rng):
+    asyncio.run(bench_timers_async(results))
+
+# Building the candidate index, then following rounds the way a bot in a room
+# does: the cost of reading one revealed mask or miss, and of choosing a guess
+def bench_bots_index(results, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        for size in DB_SIZES:
+            source = os.path.join(directory, "db{}.txt".format(size))
+            write_text_database(source, size, rng)
+            database = keyword_db.read_database(source)
+            results["bots.index.{}".format(size)] = best_of(lambda: bots.CandidateIndex(database), repeats=3)
+
+            observe_times = []
+            choose_times = []
+            bots.get_index(database)
+            guesser = bots.Guesser(lambda: database, difficulty=1.0, rng=random.Random(rng.random()))
+            for _ in range(BOT_ROUNDS):
+                keyword = database.keyword(rng.randrange(len(database)))
+                keyword_round = KeywordRound(keyword)
+                guesser.observe(Message(MessageType.GAME_STARTED, (len(keyword), "", keyword_round.masked_word())))
+                while not keyword_round.is_solved():
+                    guesser.observe(Message(MessageType.YOUR_TURN, ("bot",)))
+                    started = time.perf_counter()
+                    _, guess = guesser.reply()
+                    choose_times.append(time.perf_counter() - started)
+                    if len(guess) > 1:
+                        break
+                    occurrences = keyword_round.guess_character(guess)
+                    if occurrences:
+                        message = Message(MessageType.CHARACTER_FOUND, (guess, occurrences, keyword_round.masked_word()))
+                    else:
+                        message = Message(MessageType.CHARACTER_MISSING, (guess,))
+                    started = time.perf_counter()
+                    guesser.observe(message)
+                    observe_times.append(time.perf_counter() - started)
+            results["bots.observe.{}".format(size)] = sum(observe_times) / len(observe_times)
+            results["bots.choose.{}".format(size)] = sum(choose_times) / len(choose_times)
+            database.close()
+
+# Whole games between bots that answer at once, through the real room code
+async def bench_bots_game_async(results):
+    room = GameRoom(1, 2, 5)
+    room.timers.start()
+    database = keyword_db.read_database(os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.txt"))
+    bots.get_index(database)
+    for i in range(room.num_players):
+        guesser = bots.Guesser(lambda: database, difficulty=1.0, rng=random.Random(i))
+        room.players.append(Player(bots.BotConnection(guesser, think_time=0), None, "bot{}".format(i)))
+    started = time.perf_counter()
+    for _ in range(BOT_GAMES):
+        await room.start_game()
+        await room.end_game()
+        for player in room.players:
+            player.reset()
+    results["bots.game"] = (time.perf_counter() - started) / BOT_GAMES
+    room.timers.stop()
+
+def bench_bots(results, args, rng):
+    bench_bots_index(results, rng)
+    asyncio.run(bench_bots_game_async(results))
+
+# The messages of one game as the client sees them: a turn on every letter
+# until the keyword is solved, every other turn being the client's own
+def gui_script(keyword):
+    keyword_round = KeywordRound(keyword)
+    script = [(MessageType.GAME_STARTED, len(keyword), "A scripted game", keyword_round.masked_word())]
+    for turn, character in enumerate("etaoinshrdlcumwfgypbvkjxqz"):
+        if keyword_round.is_solved():
+            break
+        if keyword_round.is_guessed(character):
+            continue
+        script.append((MessageType.YOUR_TURN, "gui") if turn % 2 == 0 else (MessageType.WAIT_FOR_TURN,))
+        occurrences = keyword_round.guess_character(character)
+        if keyword_round.is_solved():
+            script.append((MessageType.WINNER, "gui", keyword))
+        elif occurrences:
+            script.append((MessageType.CHARACTER_FOUND, character, occurrences, keyword_round.masked_word()))
+        else:
+            script.append((MessageType.CHARACTER_MISSING, character))
+    script.append((MessageType.SCORES, [("gui", 7), ("other", 3)]))
+    return script
+
+# Drive the pygame client headless (SDL dummy video driver) from a scripted
+# server on a socket pair. Frames run back to back, yielding the GIL between
+# them so the client's network thread gets to read. Measures frame times,
+# the time from writing a message to the end of the frame that drew it, and
+# the bytes allocated per frame (peak, traced in a second pass).
+def bench_gui(results, args, rng):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    try:
+        import pygame
+        import gui
+    except ImportError:
+        print("  pygame is not installed, skipping")
+        return
+
+    def play(script, trace):
+        ours, theirs = socket.socketpair()
+        game = gui.Game(ours, pygame.display.set_mode(GUI_SIZE), max_fps=0)
+        stats = SimpleNamespace(idle=[], message=[], latency=[], idle_alloc=[], message_alloc=[])
+
+        # Frames spent waiting for the network thread count nowhere
+        def frame(idle=False):
+            if trace:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            events = game.on_frame()
+            elapsed = time.perf_counter() - started
+            handled = any(event.type == gui.SERVER_MESSAGE for event in events)
+            if handled or idle:
+                (stats.message if handled else stats.idle).append(elapsed)
+                if trace:
+                    allocated = tracemalloc.get_traced_memory()[1] - base
+                    (stats.message_alloc if handled else stats.idle_alloc).append(allocated)
+            time.sleep(0)
+            return handled
+
+        frame()  # the first frame draws everything
+        for msg_type, *fields in script:
+            sent = time.perf_counter()
+            theirs.sendall(encode(msg_type, *fields))
+            while not frame():
+                pass
+            stats.latency.append(time.perf_counter() - sent)
+            if msg_type == MessageType.YOUR_TURN and not stats.idle:
+                # A player thinking: the timer and the input field are on screen
+                for _ in range(GUI_IDLE_FRAMES):
+                    frame(idle=True)
+
+        # Hang up and let the client notice before shutting pygame down
+        theirs.close()
+        while game._running:
+            frame()
+        game.on_cleanup()
+        ours.close()
+        return stats
+
+    script = [(MessageType.WELCOME, "Player1"), (MessageType.REGISTERED, "gui"), (MessageType.SESSION, "token"),
+              (MessageType.WAITING_FOR_PLAYERS,)]
+    for _ in range(GUI_GAMES):
+        words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+                 for _ in range(rng.randint(1, 3))]
+        script += gui_script(" ".join(words))
+
+    # The client prints every message it gets
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            timed = play(script, trace=False)
+            tracemalloc.start()
+            traced = play(script, trace=True)
+            tracemalloc.stop()
+        finally:
+            sys.stdout = stdout
+
+    results["gui.frame.idle"] = sum(timed.idle) / len(timed.idle)
+    results["gui.frame.message"] = sum(timed.message) / len(timed.message)
+    results["gui.frame_p99"] = loadgen.percentile(timed.idle + timed.message, 0.99)
+    results["gui.message_to_pixel_p50"] = loadgen.percentile(timed.latency, 0.5)
+    results["gui.message_to_pixel_p99"] = loadgen.percentile(timed.latency, 0.99)
+    results["gui.alloc_bytes.idle"] = sum(traced.idle_alloc) / len(traced.idle_alloc)
+    results["gui.alloc_bytes.message"] = sum(traced.message_alloc) / len(traced.message_alloc)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+def bench_full_game(results, args, rng):
+    players = args.game_players
+    port = free_port()
+    # No leaderboard or journal, or the benchmark games would land in the real ones
+    server = subprocess.Popen([sys.executable, "server.py", "--port", str(port), "--leaderboard", "", "--journal", ""],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Wait for the server to listen
+        for _ in range(100):
+            try:
+                socket.create_connection(("localhost", port)).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        load_args = SimpleNamespace(host="localhost", port=port, players=players, games=3, strategy="frequency",
+                                    think_time=0.0, connect_rate=0.0, duration=120.0,
+                                    max_rate=connection.DEFAULT_INPUT_RATE)
+        load = asyncio.run(loadgen.run_load(load_args, verbose=False))
+        if load.games:
+            results["game.wall_time_per_game.{}".format(players)] = load.elapsed / load.games
+        results["game.turn_latency_p50.{}".format(players)] = loadgen.percentile(load.turn_latencies, 0.5)
+        results["game.turn_latency_p99.{}".format(players)] = loadgen.percentile(load.turn_latencies, 0.99)
+    finally:
+        server.terminate()
+        server.wait()
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Print every metric that got slower than the baseline by more than threshold
+def compare(baseline_path, current, threshold):
+    with open(baseline_path) as file:
+        baseline = json.load(file)["results"]
+    regressions = 0
+    for name in sorted(current):
+        if name not in baseline or baseline[name] <= 0:
+            continue
+        ratio = current[name] / baseline[name]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{:<40} {:>12.3e} -> {:>12.3e}  x{:.2f}{}".format(name, baseline[name], current[name], ratio, flag))
+    return regressions
+
+SUITES = {
+    "database": bench_database,
+    "guesses": bench_guesses,
+    "fanout": bench_fanout,
+    "spectators": bench_spectators,
+    "journal": bench_journal,
+    "matchmaking": bench_matchmaking,
+    "timers": bench_timers,
+    "bots": bench_bots,
+    "game": bench_full_game,
+    "gui": bench_gui,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Magical Wheel server hot paths")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES),
+                        help="suite to run (repeatable, default: all)")
+    parser.add_argument("--game-players", type=int, default=200, help="simulated players in the end-to-end game benchmark")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--seed", type=int, default=1412)
+    args = parser.parse_args()
+
+    suites = args.suite or list(SUITES)
+    rng = random.Random(args.seed)
+    results = {}
+    for suite in suites:
+        print("Running {} benchmarks...".format(suite))
+        SUITES[suite](results, args, rng)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    print("Wrote {} results to {}".format(len(results), args.output))
+
+    if args.compare:
+        if compare(args.compare, results, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
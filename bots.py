@@ -0,0 +1,422 @@
+import asyncio
+import itertools
+import random
+import weakref
+from collections import Counter
+
+from protocol import FrameDecoder, MessageType, encode
+
+try:
+    import numpy
+    if not hasattr(numpy, "bitwise_count"):  # added in NumPy 2.0
+        numpy = None
+except ImportError:
+    numpy = None
+
+# Server-side opponents that fill empty seats in a room.
+# A bot is an ordinary Player whose connection is a BotConnection: the room
+# encodes, broadcasts and evaluates for it exactly as for a person, and the
+# bot decodes what it is sent and answers through the protocol decoder.
+#
+# Guesses come from a CandidateIndex over the keyword database. For every
+# keyword length it holds bitsets over the keywords of that length:
+#   at[p][c]      keywords with character c at position p
+#   counts[c][k]  keywords with exactly k occurrences of c
+#   contains[c]   keywords with c anywhere
+#   in_category[n]  keywords of category number n
+# A revealed mask narrows a bot's candidates with one AND per revealed
+# position and one for the count, a miss with a single AND, so following a
+# round costs microseconds even for a large database. The bitsets are NumPy
+# arrays of 64-bit words when NumPy is installed and Python integers
+# otherwise; both support &, | and ~ alike. Building the index of a large
+# database takes seconds, so the server builds it in a worker thread (see
+# prepare_index) and bots guess blind until it is ready.
+#
+# Difficulty runs from 0 (guesses common letters blindly) to 1 (always
+# plays the letter found in the most remaining candidates, and guesses the
+# keyword as soon as only one is left).
+
+BOT_PREFIX = "[bot]"  # nicknames players cannot register
+DEFAULT_DIFFICULTY = 0.7
+DEFAULT_THINK_TIME = 1.0  # mean seconds a bot takes to answer
+
+# Most common letters in English first, for guesses without the index
+FREQUENCY_ORDER = "etaoinshrdlcumwfgypbvkjxqz"
+
+def _pack(flags):
+    # Little-endian bits padded to whole 64-bit words
+    packed = numpy.packbits(flags, bitorder="little")
+    words = numpy.zeros(-(-len(packed) // 8) * 8, dtype=numpy.uint8)
+    words[:len(packed)] = packed
+    return words.view(numpy.uint64)
+
+def _from_indexes(size, indexes):
+    data = bytearray((size + 7) // 8)
+    for i in indexes:
+        data[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(data, "little")
+
+class LengthIndex:
+    def __init__(self, length, entries):
+        self.length = length
+        self.entries = [index for index, _, _ in entries]  # database index of every bit
+        self.size = len(entries)
+        self.at = [{} for _ in range(length)]
+        self.counts = {}
+        self.contains = {}
+        self.in_category = {}
+        if numpy is not None:
+            self._build_arrays([word for _, word, _ in entries], [number for _, _, number in entries])
+        else:
+            self._build_integers([word for _, word, _ in entries], [number for _, _, number in entries])
+        self.letters = sorted(c for c in self.contains if not c.isspace())
+        if numpy is not None and self.letters:
+            self._contains_matrix = numpy.stack([self.contains[c] for c in self.letters])
+
+    def _build_arrays(self, words, categories):
+        categories = numpy.array(categories, dtype=numpy.uint16)
+        for number in numpy.unique(categories):
+            self.in_category[int(number)] = _pack(categories == number)
+        codes = numpy.array([[ord(c) for c in word] for word in words], dtype=numpy.uint32).reshape(len(words), self.length)
+        self.everything = _pack(numpy.ones(self.size, dtype=bool))
+        self.nothing = self.everything & 0
+        for p in range(self.length):
+            column = codes[:, p]
+            for code in numpy.unique(column):
+                self.at[p][chr(code)] = _pack(column == code)
+        for code in numpy.unique(codes):
+            occurrences = (codes == code).sum(axis=1)
+            c = chr(code)
+            self.counts[c] = {int(k): _pack(occurrences == k) for k in numpy.unique(occurrences)}
+            self.contains[c] = _pack(occurrences > 0)
+            self.counts[c].setdefault(0, self.everything & ~self.contains[c])
+
+    def _build_integers(self, words, categories):
+        size = self.size
+        self.everything = (1 << size) - 1
+        self.nothing = 0
+        by_category = {}
+        for i, number in enumerate(categories):
+            by_category.setdefault(number, []).append(i)
+        for number, indexes in by_category.items():
+            self.in_category[number] = _from_indexes(size, indexes)
+        at = [{} for _ in range(self.length)]
+        counts = {}
+        for i, word in enumerate(words):
+            for p, c in enumerate(word):
+                at[p].setdefault(c, []).append(i)
+            for c, k in Counter(word).items():
+                counts.setdefault(c, {}).setdefault(k, []).append(i)
+        for p, characters in enumerate(at):
+            for c, indexes in characters.items():
+                self.at[p][c] = _from_indexes(size, indexes)
+        for c, by_count in counts.items():
+            self.counts[c] = {k: _from_indexes(size, indexes) for k, indexes in by_count.items()}
+            contains = 0
+            for bits in self.counts[c].values():
+                contains |= bits
+            self.contains[c] = contains
+            self.counts[c][0] = self.everything & ~contains
+
+    def count(self, bits):
+        if numpy is not None:
+            return int(numpy.bitwise_count(bits).sum())
+        return bits.bit_count()
+
+    # Database indexes of the candidates left
+    def members(self, bits):
+        if numpy is not None:
+            positions = numpy.flatnonzero(numpy.unpackbits(bits.view(numpy.uint8), bitorder="little"))
+            return [self.entries[i] for i in positions]
+        found = []
+        while bits:
+            low = bits & -bits
+            found.append(self.entries[low.bit_length() - 1])
+            bits ^= low
+        return found
+
+    # Keywords that have c exactly at the given positions and nowhere else
+    def narrow(self, bits, c, positions):
+        by_count = self.counts.get(c)
+        if by_count is None:
+            # No keyword of this length has c at all
+            return self.nothing if positions else bits
+        bits = bits & by_count.get(len(positions), self.nothing)
+        for p in positions:
+            bits = bits & self.at[p].get(c, self.nothing)
+        return bits
+
+    # The letter not yet guessed found in the most candidates, or None
+    def best_letter(self, bits, guessed):
+        if not self.letters:
+            return None
+        if numpy is not None:
+            scores = numpy.bitwise_count(self._contains_matrix & bits).sum(axis=1, dtype=numpy.int64)
+            for i in numpy.argsort(-scores, kind="stable"):
+                if scores[i] == 0:
+                    return None
+                if self.letters[i] not in guessed:
+                    return self.letters[i]
+            return None
+        best = None
+        best_score = 0
+        for c in self.letters:
+            if c not in guessed:
+                score = (bits & self.contains[c]).bit_count()
+                if score > best_score:
+                    best, best_score = c, score
+        return best
+
+class CandidateIndex:
+    def __init__(self, database):
+        by_length = {}
+        numbers = database.category_numbers()
+        for i in range(len(database)):
+            keyword = database.keyword(i)
+            lowered = keyword.lower()
+            if len(lowered) == len(keyword):  # a mask is as long as the keyword
+                by_length.setdefault(len(keyword), []).append((i, lowered, numbers[i]))
+        self.lengths = {length: LengthIndex(length, entries) for length, entries in by_length.items()}
+        self.letters = sorted(set().union(*(words.letters for words in self.lengths.values())))
+
+_indexes = weakref.WeakKeyDictionary()  # database -> CandidateIndex, or a future while it is built
+
+# The index of a loaded database if it has been built, None otherwise
+def find_index(database):
+    index = _indexes.get(database)
+    return index if isinstance(index, CandidateIndex) else None
+
+# The index of a loaded database, built right away if need be
+def get_index(database):
+    index = find_index(database)
+    if index is None:
+        index = _indexes[database] = CandidateIndex(database)
+    return index
+
+# Start building the index of a database in the loop's default executor,
+# unless it is built or being built already
+def prepare_index(database):
+    if database in _indexes:
+        return
+    future = _indexes[database] = asyncio.get_running_loop().run_in_executor(None, CandidateIndex, database)
+
+    def built(future):
+        try:
+            _indexes[database] = future.result()
+        except Exception as e:
+            print("Could not index the keyword database for bots: {}".format(e))
+    future.add_done_callback(built)
+
+# What a bot knows about the round being played and what it answers.
+# load_database() returns the database the room plays from, which may change
+# between rounds; category restricts the candidates like the room's keywords.
+class Guesser:
+    def __init__(self, load_database, difficulty=DEFAULT_DIFFICULTY, rng=None, category=None):
+        self.load_database = load_database
+        self.database = None
+        self.index = None
+        self.category = category
+        self.difficulty = difficulty
+        self.rng = rng if rng is not None else random.Random()
+        self.words = None       # LengthIndex of the keyword's length
+        self.candidates = None
+        self.mask = ""
+        self.guessed = set()
+        self.own_guesses = 0    # the room's guess_count for the bot
+        self.my_turn = False
+        self.expecting = None   # MessageType the room waits for from the bot
+        self.active = True
+
+    def observe(self, message):
+        msg_type = message.type
+        if msg_type == MessageType.GAME_STARTED:
+            self.start(message.fields[2])
+        elif msg_type == MessageType.CHARACTER_FOUND:
+            character, _, mask = message.fields
+            self.reveal(character.lower(), mask)
+            self._turn_used()
+        elif msg_type == MessageType.CHARACTER_MISSING:
+            # Only ever sent to the player who guessed
+            self.reveal(message.fields[0].lower(), self.mask)
+            self._turn_used()
+        elif msg_type == MessageType.YOUR_TURN:
+            self.my_turn = True
+            self.expecting = MessageType.GUESS
+        elif msg_type == MessageType.TIMEOUT:
+            self._turn_used()
+            self.expecting = None
+        elif msg_type == MessageType.WAIT_FOR_TURN:
+            self.my_turn = False
+            self.expecting = None
+        elif msg_type == MessageType.DISQUALIFIED:
+            self.active = False
+            self.expecting = None
+        elif msg_type == MessageType.SCORES:
+            self.expecting = MessageType.VOTE
+
+    def _turn_used(self):
+        if self.my_turn:
+            self.own_guesses += 1
+            self.my_turn = False
+
+    def start(self, mask):
+        self.mask = mask
+        self.guessed = set()
+        self.own_guesses = 0
+        self.my_turn = False
+        self.active = True
+        self.database = self.load_database()
+        self.index = find_index(self.database)
+        if self.index is None:
+            prepare_index(self.database)
+            self.words = None
+        else:
+            self.words = self.index.lengths.get(len(mask))
+        if self.words is None:
+            self.candidates = None
+            return
+        candidates = self.words.everything
+        if self.category is not None:
+            categories = self.database.categories
+            number = categories.index(self.category) if self.category in categories else None
+            candidates = candidates & self.words.in_category.get(number, self.words.nothing)
+        # The gaps of a phrase are shown from the start
+        for c in self.words.counts:
+            if c.isspace():
+                candidates = self.words.narrow(candidates, c, [p for p, m in enumerate(mask) if m == c])
+        self.candidates = candidates
+
+    def reveal(self, character, mask):
+        self.guessed.add(character)
+        self.mask = mask
+        if self.candidates is not None:
+            positions = [p for p, c in enumerate(mask) if c.lower() == character]
+            self.candidates = self.words.narrow(self.candidates, character, positions)
+
+    # The message to answer with, None if the room is not waiting for one
+    def reply(self):
+        if self.expecting == MessageType.VOTE:
+            self.expecting = None
+            return MessageType.VOTE, "y"
+        if self.expecting != MessageType.GUESS or not self.active:
+            return None
+        self.expecting = None
+        return MessageType.GUESS, self.next_guess()
+
+    def next_guess(self):
+        skilled = self.rng.random() < self.difficulty
+        if skilled and self.candidates is not None:
+            left = self.words.count(self.candidates)
+            if left == 1 and self.own_guesses > 0:
+                return self.database.keyword(self.words.members(self.candidates)[0])
+            if left:
+                letter = self.words.best_letter(self.candidates, self.guessed)
+                if letter is not None:
+                    return self._guess(letter)
+        # Blind: a common letter, sometimes not the most common one left
+        remaining = [c for c in FREQUENCY_ORDER if c not in self.guessed] or self._untried()
+        return self._guess(remaining[min(len(remaining) - 1, int(self.rng.expovariate(1.0)))])
+
+    # Once the common letters are used up: the characters of keywords this
+    # long, then of the whole database, then any other. The room re-asks
+    # for a repeated guess without moving on, so one is never repeated.
+    def _untried(self):
+        pools = []
+        if self.words is not None:
+            pools.append(self.words.letters)
+        if self.index is not None:
+            pools.append(self.index.letters)
+        for pool in pools:
+            left = [c for c in pool if c not in self.guessed]
+            if left:
+                return left
+        return [next(c for c in map(chr, itertools.count(0x21)) if c not in self.guessed and not c.isspace())]
+
+    def _guess(self, letter):
+        # Whatever comes back, the letter counts as tried
+        self.guessed.add(letter)
+        return letter
+
+# Stands in for Connection. Everything the room sends is decoded and shown to
+# the guesser; a read waits think_time seconds (on average) and returns the
+# guesser's answer, decoded from its wire encoding like a player's would be.
+class BotConnection:
+    def __init__(self, guesser, think_time=DEFAULT_THINK_TIME, rng=None):
+        self.guesser = guesser
+        self.think_time = think_time
+        self.rng = rng if rng is not None else random.Random()
+        self.addr = None
+        self.request_handlers = {}
+        self.closed = False
+        self._loop = asyncio.get_running_loop()
+        self._inbound = FrameDecoder()
+        self._outbound = FrameDecoder()
+        self._reader = None
+        self._read_expired = False
+        self._close_callbacks = []
+
+    def send(self, data, droppable=False):
+        if self.closed:
+            return
+        for message in self._inbound.feed(data):
+            self.guesser.observe(message)
+
+    def send_message(self, msg_type, *fields):
+        self.send(encode(msg_type, *fields))
+
+    def send_buffers(self, buffers):
+        for data in buffers:
+            self.send(data)
+
+    async def read_message(self):
+        if self.closed:
+            return None
+        if self._read_expired:
+            raise asyncio.TimeoutError
+        self._reader = self._loop.create_future()
+        delay = self.rng.expovariate(1.0 / self.think_time) if self.think_time > 0 else 0
+        answer = self._loop.call_later(delay, self._answer)
+        try:
+            return await self._reader
+        finally:
+            answer.cancel()
+            self._reader = None
+
+    def _answer(self):
+        reply = self.guesser.reply()
+        if reply is not None and self._reader is not None and not self._reader.done():
+            self._reader.set_result(self._outbound.feed(encode(*reply))[0])
+
+    # A bot only ever answers what it is asked
+    def accept_input(self, accepting):
+        pass
+
+    def ask(self):
+        pass
+
+    def expire_read(self):
+        self._read_expired = True
+        if self._reader is not None and not self._reader.done():
+            self._reader.set_exception(asyncio.TimeoutError())
+
+    def clear_read_deadline(self):
+        self._read_expired = False
+
+    def add_close_callback(self, callback):
+        if self.closed:
+            callback()
+        else:
+            self._close_callbacks.append(callback)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._reader is not None and not self._reader.done():
+            self._reader.set_result(None)
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def abort(self):
+        self.close()
@@ -1,67 +1,140 @@
 import socket
 import threading
+import time
+from collections import deque
+
+from protocol import FrameDecoder, MessageType, encode, format_message
+
+host = "localhost"
+port = 5555
+RECONNECT_ATTEMPTS = 5
 
 connected = True
 game_ended = False
+client_socket = None
+session_token = None
+voting = False
 game_end_event = threading.Event()
 player_turn_event = threading.Event()
 
-def receive_messages(client_socket):
-    global connected, game_ended, game_end_event, player_turn_event
+decoder = FrameDecoder()
+pending_messages = deque()
+
+# Block until the next complete message arrives, however the stream was split
+def receive_message(client_socket):
+    while not pending_messages:
+        data = client_socket.recv(1024)
+        if not data:
+            return None
+        pending_messages.extend(decoder.feed(data))
+    return pending_messages.popleft()
+
+# Rejoin the game on a new connection after the old one dropped.
+# Returns True once the server has sent the state of the game.
+def resume_session():
+    global client_socket, decoder
+    for attempt in range(RECONNECT_ATTEMPTS):
+        time.sleep(0.2 * 2 ** attempt)
+        try:
+            sock = socket.create_connection((host, port))
+        except OSError:
+            continue
+        decoder = FrameDecoder()
+        pending_messages.clear()
+        sock.sendall(encode(MessageType.RESUME, session_token))
+        message = receive_message(sock)
+        while message is not None and message.type == MessageType.WELCOME:
+            message = receive_message(sock)
+        if message is None or message.type != MessageType.SNAPSHOT:
+            sock.close()
+            return False
+        client_socket.close()
+        client_socket = sock
+        print(format_message(message))
+        return True
+    return False
+
+def receive_messages():
+    global connected, game_ended, voting, game_end_event, player_turn_event, session_token
     while connected and not game_ended:
         try:
-            message = client_socket.recv(1024).decode()
-            if not message:
+            message = receive_message(client_socket)
+            if message is None:
+                print("Connection lost, trying to rejoin...")
+                if session_token is not None and resume_session():
+                    continue
                 break
-            print(message)
-            if message == "Game is ending. Thank you for playing!":
+            if message.type == MessageType.SESSION:
+                session_token = message.fields[0]
+                continue
+            print(format_message(message))
+            if message.type == MessageType.GAME_CLOSED:
                 game_ended = True
                 print("Game ended. Press enter to exit...")
                 game_end_event.set()
+                player_turn_event.set()
                 break
-            elif "your turn" in message.lower():
+            elif message.type == MessageType.YOUR_TURN:
                 player_turn_event.set()
-            elif "missed your turn" in message.lower():
+            elif message.type == MessageType.TIMEOUT:
                 player_turn_event.clear()
+            elif message.type == MessageType.SCORES:
+                print("Do you want to restart the game? (Y/N): ")
+                voting = True
+                player_turn_event.set()
+            elif message.type == MessageType.GAME_STARTED:
+                voting = False
+            elif message.type == MessageType.SNAPSHOT:
+                voting = message.fields[0] == "voting"
+                player_turn_event.set()
         except socket.timeout:
             print("You've missed your turn!")
             break
     connected = False
 
-def input_thread_func(client_socket):
-    global connected, game_ended, player_turn_event
+def input_thread_func():
+    global connected, game_ended, voting, player_turn_event
     while connected and not game_ended:
         player_turn_event.wait()  # Wait for player's turn
         if game_end_event.is_set():
             break
         try:
             message = input()
-            client_socket.send(message.encode())
+            if message.strip().lower() == "/top":
+                client_socket.sendall(encode(MessageType.LEADERBOARD_REQUEST, 10))
+            elif voting:
+                client_socket.sendall(encode(MessageType.VOTE, message))
+            else:
+                client_socket.sendall(encode(MessageType.GUESS, message))
         except EOFError:  # Raised when the input buffer is empty
             pass
+        except OSError:  # Connection dropped, the receive thread rejoins
+            pass
 
 def main():
-    global connected, game_ended
-    host = "localhost"
-    port = 5555
-
+    global connected, game_ended, client_socket
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client_socket.connect((host, port))
 
     # Register to the server
-    print(client_socket.recv(1024).decode())
-    nickname = input()
-    client_socket.send(nickname.encode())
-
-    # Receive initial messages from the server
-    print(client_socket.recv(1024).decode())
+    print(format_message(receive_message(client_socket)))
+    registered = False
+    while not registered:
+        nickname = input()
+        client_socket.sendall(encode(MessageType.NICKNAME, nickname))
+        response = receive_message(client_socket)
+        if response is None:
+            client_socket.close()
+            return
+        print(format_message(response))
+        registered = response.type == MessageType.REGISTERED
 
     # Start receiving messages in a separate thread
-    receive_thread = threading.Thread(target=receive_messages, args=(client_socket,))
+    receive_thread = threading.Thread(target=receive_messages)
     receive_thread.start()
 
     # Start input thread
-    input_thread = threading.Thread(target=input_thread_func, args=(client_socket,))
+    input_thread = threading.Thread(target=input_thread_func)
     input_thread.start()
 
     # Wait for threads to finish
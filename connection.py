@@ -0,0 +1,348 @@
+import asyncio
+from collections import deque
+
+from metrics import RECV_WAIT_TIME
+from protocol import FrameDecoder, MessageType, ProtocolError, encode
+
+# What to do when a client stops reading and its outbound buffer fills up
+OVERFLOW_DROP = "drop"              # drop droppable messages, disconnect only for critical ones
+OVERFLOW_DISCONNECT = "disconnect"  # disconnect on any overflow
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_DISCONNECT)
+
+DEFAULT_MAX_OUTBOUND = 64 * 1024
+
+# Limits on what a client sends; see _on_readable
+DEFAULT_MAX_INBOUND = 8 * 1024  # bytes of an incomplete frame before the client is cut off
+DEFAULT_INPUT_RATE = 20.0       # messages per second a client may send on average, 0 for no limit
+DEFAULT_INPUT_BURST = 40        # messages a client may send at once
+MAX_INBOX = 16                  # messages kept for the game before more are dropped
+RECV_SIZE = 4096
+
+# Messages a lagging client can miss without getting out of sync with the game
+DROPPABLE_MESSAGES = frozenset((MessageType.WAIT_FOR_TURN,))
+
+class OutboundStats:
+    __slots__ = ("bytes_queued", "bytes_sent", "bytes_pending", "messages_dropped",
+                 "overflow_disconnects", "blocked_time")
+
+    def __init__(self):
+        self.bytes_queued = 0
+        self.bytes_sent = 0
+        self.bytes_pending = 0
+        self.messages_dropped = 0
+        self.overflow_disconnects = 0
+        self.blocked_time = 0.0  # seconds spent waiting for the socket to become writable
+
+class InboundStats:
+    __slots__ = ("messages_received", "messages_throttled", "messages_discarded", "flood_disconnects")
+
+    def __init__(self):
+        self.messages_received = 0
+        self.messages_throttled = 0  # dropped by the rate limit
+        self.messages_discarded = 0  # arrived while the game was not waiting for the client
+        self.flood_disconnects = 0
+
+# Totals over every connection in this process
+outbound_totals = OutboundStats()
+inbound_totals = InboundStats()
+open_connections = 0
+
+# Non-blocking wrapper around a client socket.
+# All reads and writes go through the server's event loop, so a slow or idle
+# client never ties up a thread of its own.
+class Connection:
+    def __init__(self, sock, addr, max_outbound=DEFAULT_MAX_OUTBOUND, overflow_policy=OVERFLOW_DROP,
+                 max_inbound=DEFAULT_MAX_INBOUND, input_rate=DEFAULT_INPUT_RATE, input_burst=DEFAULT_INPUT_BURST):
+        self.sock = sock
+        self.addr = addr
+        self.sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        global open_connections
+        open_connections += 1
+        self.max_outbound = max_outbound
+        self.overflow_policy = overflow_policy
+        self.stats = OutboundStats()
+        self._outbound = bytearray()
+        self._blocked_since = None
+        self._writing = False
+        self._flush_scheduled = False
+        self._reader = None
+        self._read_expired = False
+        self._decoder = FrameDecoder()
+        self._inbox = deque()
+        self.request_handlers = {}  # message type -> handler(message) answered on arrival
+        self.max_inbound = max_inbound
+        self.input_rate = input_rate
+        self.input_burst = input_burst
+        self.input_stats = InboundStats()
+        self._tokens = input_burst
+        self._refilled = self._loop.time()
+        self._accepting = True
+        self._asked = True  # WELCOME asks for a nickname
+        self._closing = False
+        self._close_callbacks = []
+        self.closed = False
+        self._loop.add_reader(self.sock, self._on_readable)
+
+    # Everything the client sends is read as soon as it arrives, so input
+    # the game is not waiting for can be dropped on the spot instead of
+    # piling up in the kernel to be taken for a later answer.
+    def _on_readable(self):
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.abort()
+            return
+        try:
+            messages = self._decoder.feed(data)
+        except ProtocolError:
+            self.abort()
+            return
+        if self._decoder.pending() > self.max_inbound:
+            # A frame larger than anything the game takes
+            self._cut_off()
+            return
+
+        now = self._loop.time()
+        for message in messages:
+            self.input_stats.messages_received += 1
+            inbound_totals.messages_received += 1
+            # The first answer to each prompt never costs a token, so a turn
+            # or vote is never lost to the limit. Retries, and whatever the
+            # client sends unasked or in bulk, do.
+            solicited = (self._asked and self._accepting and not self._inbox
+                         and message.type not in self.request_handlers)
+            if solicited:
+                self._asked = False
+            elif not self._take_token(now):
+                if self.closed:
+                    return
+                continue
+            handler = self.request_handlers.get(message.type)
+            if handler is not None:
+                handler(message)
+                if self.closed:
+                    return
+            elif self._accepting and len(self._inbox) < MAX_INBOX:
+                self._inbox.append(message)
+            else:
+                self.input_stats.messages_discarded += 1
+                inbound_totals.messages_discarded += 1
+        if self._inbox and self._reader is not None and not self._reader.done():
+            self._reader.set_result(None)
+
+    # Token bucket for everything but the first answer to a prompt: input_rate messages a second on average
+    # and input_burst at once. A message without a token is dropped, and a
+    # client that keeps on sending until it owes input_burst more is
+    # disconnected.
+    def _take_token(self, now):
+        if not self.input_rate:
+            return True
+        self._tokens = min(self.input_burst, self._tokens + (now - self._refilled) * self.input_rate)
+        self._refilled = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return True
+        self.input_stats.messages_throttled += 1
+        inbound_totals.messages_throttled += 1
+        if self._tokens < -self.input_burst:
+            self._cut_off()
+        return False
+
+    def _cut_off(self):
+        self.input_stats.flood_disconnects += 1
+        inbound_totals.flood_disconnects += 1
+        self.abort()
+
+    # Whether read_message() gets what the client sends. While it does not,
+    # the game is not waiting for this client, and everything but requests
+    # is dropped on arrival, along with whatever had not been read yet.
+    def accept_input(self, accepting):
+        self._accepting = accepting
+        if not accepting and self._inbox:
+            self.input_stats.messages_discarded += len(self._inbox)
+            inbound_totals.messages_discarded += len(self._inbox)
+            self._inbox.clear()
+
+    # The server has just asked the client for something (a turn, a vote):
+    # the first message that comes back is taken without a token. Asking
+    # again for the same thing after a bad answer should not call this.
+    def ask(self):
+        self._asked = True
+
+    # Deadline hook for timers: fail the pending read, and any read started
+    # before clear_read_deadline(), with asyncio.TimeoutError. Messages that
+    # have arrived but not been read yet are kept for the next read.
+    def expire_read(self):
+        self._read_expired = True
+        if self._reader is not None and not self._reader.done():
+            self._reader.set_exception(asyncio.TimeoutError())
+
+    def clear_read_deadline(self):
+        self._read_expired = False
+
+    # Next complete message from the peer, or None once it has gone away or
+    # sent something that is not a valid frame. Messages with a request
+    # handler are answered on arrival and never returned.
+    async def read_message(self):
+        while not self._inbox:
+            if self.closed:
+                return None
+            if self._read_expired:
+                raise asyncio.TimeoutError
+            self._reader = self._loop.create_future()
+            started = self._loop.time()
+            try:
+                await self._reader
+            finally:
+                self._reader = None
+            RECV_WAIT_TIME.observe(self._loop.time() - started)
+        return self._inbox.popleft()
+
+    def send_message(self, msg_type, *fields):
+        self.send(encode(msg_type, *fields), msg_type in DROPPABLE_MESSAGES)
+
+    # Queue data to be written at the end of the current loop iteration, so
+    # every message produced while handling one event goes out in one send.
+    # Whatever the socket does not accept is flushed once it becomes writable.
+    # The queue is bounded by max_outbound; see the OVERFLOW_* policies.
+    def send(self, data, droppable=False):
+        if self.closed or self._closing:
+            return
+        if len(self._outbound) + len(data) > self.max_outbound:
+            if droppable and self.overflow_policy == OVERFLOW_DROP:
+                self.stats.messages_dropped += 1
+                outbound_totals.messages_dropped += 1
+                return
+            # The client is too far behind to catch up, let it go
+            self.stats.overflow_disconnects += 1
+            outbound_totals.overflow_disconnects += 1
+            self.abort()
+            return
+
+        self._outbound += data
+        self._count_queued(len(data))
+        if not self._writing and not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    # Send buffers shared with other connections without copying them into
+    # this connection's queue: one vectored send straight to the socket. Only
+    # what the socket does not take right away is copied and queued.
+    def send_buffers(self, buffers):
+        if self.closed or self._closing:
+            return
+        if self._outbound or self._flush_scheduled:
+            # Keep the order of what is already queued
+            for data in buffers:
+                self.send(data)
+            return
+        size = sum(len(data) for data in buffers)
+        try:
+            sent = self.sock.sendmsg(buffers)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.abort()
+            return
+        self._count_queued(size)
+        self._count_sent(sent)
+        if sent < size:
+            rest = b"".join(buffers)[sent:]
+            if len(rest) > self.max_outbound:
+                self.stats.overflow_disconnects += 1
+                outbound_totals.overflow_disconnects += 1
+                self.abort()
+                return
+            self._outbound += rest
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if self.closed:
+            return
+        try:
+            sent = self.sock.send(self._outbound)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.abort()
+            return
+        del self._outbound[:sent]
+        self._count_sent(sent)
+
+        if self._outbound:
+            if not self._writing:
+                self._loop.add_writer(self.sock, self._flush)
+                self._writing = True
+                self._blocked_since = self._loop.time()
+            return
+
+        if self._writing:
+            self._loop.remove_writer(self.sock)
+            self._writing = False
+            self._count_blocked()
+        if self._closing:
+            self.abort()
+
+    def _count_queued(self, size):
+        self.stats.bytes_queued += size
+        self.stats.bytes_pending += size
+        outbound_totals.bytes_queued += size
+        outbound_totals.bytes_pending += size
+
+    def _count_sent(self, size):
+        self.stats.bytes_sent += size
+        self.stats.bytes_pending -= size
+        outbound_totals.bytes_sent += size
+        outbound_totals.bytes_pending -= size
+
+    def _count_blocked(self):
+        if self._blocked_since is not None:
+            blocked = self._loop.time() - self._blocked_since
+            self.stats.blocked_time += blocked
+            outbound_totals.blocked_time += blocked
+            self._blocked_since = None
+
+    # Run callback() once when the connection is closed for any reason
+    def add_close_callback(self, callback):
+        if self.closed:
+            callback()
+        else:
+            self._close_callbacks.append(callback)
+
+    # Close once everything queued so far has been written
+    def close(self):
+        if self.closed:
+            return
+        self._closing = True
+        if not self._outbound:
+            self.abort()
+
+    # Close right away, dropping anything still queued
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        global open_connections
+        open_connections -= 1
+        self._loop.remove_reader(self.sock)
+        if self._reader is not None and not self._reader.done():
+            self._reader.set_result(None)
+        if self._writing:
+            self._loop.remove_writer(self.sock)
+            self._writing = False
+            self._count_blocked()
+        # Whatever was still queued will never be sent
+        outbound_totals.bytes_pending -= len(self._outbound)
+        self.stats.bytes_pending = 0
+        self._outbound.clear()
+        self.sock.close()
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            callback()
@@ -1,10 +1,14 @@
+import argparse
 import pygame
 import pygame_textinput
+from collections import OrderedDict
 from enum import Enum 
 import time
 import socket
 import threading
 
+from protocol import FrameDecoder, MessageType, encode, format_message
+
 # GUI for the players
 # It contains: 
 # - Nickname input field (done)
@@ -22,13 +26,39 @@ import threading
 pygame.font.init()
 font = pygame.font.SysFont('roboto.ttf', 35)
 
-host = "localhost"
-port = 5555
-connected = True
-game_exiting_event = threading.Event()
-game_ending_event = threading.Event()
-player_turn_event = threading.Event()
-player_disqualified_event = threading.Event()
+MAX_FPS = 30  # the screen only changes on input, server messages and the timer
+TEXT_CACHE_SIZE = 256
+BACKGROUND = (255, 255, 255)
+
+# Rendered text surfaces keyed by (text, colour), so a label is only rendered
+# again when what it says changes. The least recently used entries are evicted.
+class TextCache:
+    def __init__(self, font, size=TEXT_CACHE_SIZE):
+        self._font = font
+        self._size = size
+        self._surfaces = OrderedDict()
+
+    def render(self, text, color=(0, 0, 0)):
+        key = (text, color)
+        surface = self._surfaces.get(key)
+        if surface is None:
+            surface = self._font.render(text, True, color)
+            self._surfaces[key] = surface
+            if len(self._surfaces) > self._size:
+                self._surfaces.popitem(last=False)
+        else:
+            self._surfaces.move_to_end(key)
+        return surface
+
+text_cache = TextCache(font)
+
+HOST = "localhost"
+PORT = 5555
+
+# Posted by the network thread for every server message (event.message), and
+# with message=None once the connection is gone. The thread only decodes;
+# all game state changes happen on the main thread as these events arrive.
+SERVER_MESSAGE = pygame.event.custom_type()
 
 class GameState(Enum):
     REGISTERING = 0
@@ -42,26 +72,40 @@ class TurnState(Enum):
     WAITING = 1
     DISQUALIFIED = 2
  
+# The client window. It talks to the server over client_socket and draws on
+# screen, both created here unless given, so it can also run against a
+# scripted server on a headless display (SDL_VIDEODRIVER=dummy). Call
+# on_execute() to run it.
 class Game:
-    def __init__(self):
+    def __init__(self, client_socket=None, screen=None, max_fps=MAX_FPS, host=HOST, port=PORT):
         self._running = True
+        self._max_fps = max_fps
         pygame.init()
 
         # Connect to the server
-        self._client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._client_socket.connect((host, port))
+        if client_socket is None:
+            client_socket = socket.create_connection((host, port))
+        self._client_socket = client_socket
         # self.buffer_responses()
-        
-        thread = threading.Thread(target=self.handle_message)
-        thread.start()
 
         # Display configurations
-        self._display_info = pygame.display.Info()
-        self._screen = pygame.display.set_mode([self._display_info.current_w, self._display_info.current_h], pygame.HWSURFACE | pygame.DOUBLEBUF)
+        if screen is None:
+            display_info = pygame.display.Info()
+            # Single buffered, so a frame can update just the rectangles that changed
+            screen = pygame.display.set_mode([display_info.current_w, display_info.current_h])
+        self._screen = screen
+        self._width, self._height = screen.get_size()
+        self._clock = pygame.time.Clock()
+        self._drawn = None  # slot -> (surface, rect) shown on screen, None before the first frame
 
         # Game configurations
         self._game_state = GameState.REGISTERING
         self._turn_state = TurnState.WAITING
+        self._game_exiting = False
+        self._game_ending = False
+        self._player_turn = False
+        self._player_disqualified = False
+        self._session_token = None
         
         self._start_time = pygame.time.get_ticks()
         self._timer_duration = 5000
@@ -74,41 +118,30 @@ class Game:
         # self._play_flag = False
 
         # Nickname input
-        self._nickname_input_label = font.render('Enter a nickname: ', True, (0, 0, 0))
+        self._nickname_input_label = text_cache.render('Enter a nickname: ')
         self._nickname_input_field = pygame_textinput.TextInputVisualizer()
 
         # Points
         self._points = 0
-        self._points_text = font.render('Points: ' + str(self._points), True, (0, 0, 0))
+        self._points_text = text_cache.render('Points: ' + str(self._points))
 
         # Timer initial configurations
         self._start_time = pygame.time.get_ticks()
         self._timer_duration = 60000
         self._remaining_time = self._timer_duration // 1000
-        self._timer = font.render('Time remaining: ' + str(self._remaining_time), True, (255, 0, 0))
+        self._timer = text_cache.render('Time remaining: ' + str(self._remaining_time), (255, 0, 0))
 
         # Answer input
         self.set_keyword_and_description('', '')
-        self._answer_input_label = font.render('Enter your answer (a character or the whole keyword): ', True, (0, 0, 0))
+        self._answer_input_label = text_cache.render('Enter your answer (a character or the whole keyword): ')
         self._answer_input_field = pygame_textinput.TextInputVisualizer()
 
-        # Game announcement
-        self._annoucement_1 = ''
-        self._announcement_1_text = font.render(self._annoucement_1, True, (0, 0, 0))
-        self._annoucement_2 = ''
-        self._announcement_2_text = font.render(self._annoucement_2, True, (0, 0, 0))
-        self._annoucement_3 = ''
-        self._announcement_3_text = font.render(self._annoucement_3, True, (0, 0, 0))
-        self._annoucement_4 = ''
-        self._announcement_4_text = font.render(self._annoucement_4, True, (0, 0, 0))
-        self._annoucement_5 = ''
-        self._announcement_5_text = font.render(self._annoucement_5, True, (0, 0, 0))
-        self._annoucement_6 = ''
-        self._announcement_6_text = font.render(self._annoucement_6, True, (0, 0, 0))
-        self._annoucement_7 = ''
-        self._announcement_7_text = font.render(self._annoucement_7, True, (0, 0, 0))
-
-        self.on_execute()
+        # Game announcements, lines 1 to 7
+        self._announcement_texts = [text_cache.render('')] * 7
+
+        # Only listen to the server once everything it can update exists
+        thread = threading.Thread(target=self.handle_message, daemon=True)
+        thread.start()
     
     # Helper to buffer the unnecessary responses from the server
     # def buffer_responses(self):
@@ -116,7 +149,7 @@ class Game:
 
     # Check with the server if the nickname is already taken
     def on_submit_nickname(self, nickname):
-        self._client_socket.send(nickname.encode())
+        self._client_socket.sendall(encode(MessageType.NICKNAME, nickname))
     #     response = self._client_socket.recv(1024).decode()
     #     if response == "Nickname already taken. Please enter a different one: ":
     #         return False
@@ -125,11 +158,16 @@ class Game:
     def restart_game(self):
         # self._wait_flag = False
         # self._play_flag = False
-        game_exiting_event.clear()
-        game_ending_event.clear()
-        player_turn_event.clear()
-        player_disqualified_event.clear()
+        self._game_exiting = False
+        self._game_ending = False
+        self._player_turn = False
+        self._player_disqualified = False
         self._game_state = GameState.WAITING_FOR_START
+        self.show_waiting_room()
+
+    def show_waiting_room(self):
+        self.set_annoucement(1, 'Waiting for other players...')
+        self.set_annoucement(2, 'Game will exit automatically if not enough player joins.')
 
     # Wait for the server to send the game start message
     # def wait_for_start(self):
@@ -149,97 +187,88 @@ class Game:
     def set_keyword_and_description(self, keyword, description):
         self._keyword = keyword
         self._description = description
-        self._keyword = font.render('Keyword: {}'.format(self._keyword), True, (0, 0, 255))
-        self._hint = font.render('Hint: {}'.format(self._description), True, (0, 0, 255))
+        self._keyword = text_cache.render('Keyword: {}'.format(self._keyword), (0, 0, 255))
+        self._hint = text_cache.render('Hint: {}'.format(self._description), (0, 0, 255))
 
     def set_nickname_input_label(self, announcement):
-        self._nickname_input_label = font.render(announcement, True, (255, 0, 0))
+        self._nickname_input_label = text_cache.render(announcement, (255, 0, 0))
     
+    # Network thread: decode frames and hand them to the main loop in order
     def handle_message(self):
+        decoder = FrameDecoder()
         while True:
             try:
-                message = self._client_socket.recv(1024).decode()
-                if not message:
-                    break
-                print(message)
-                if message == "Nickname already taken or invalid length. Choose another one: ":
-                    self.set_nickname_input_label(message)
-                elif message == "Registration Completed Successfully":
-                    self.set_nickname_input_label('Enter a nickname: ')
-                    self._game_state = GameState.WAITING_FOR_START
-                elif "Game started!" in message:
-                    self._game_state = GameState.PLAYING
-                    self.reset_timer()
-
-                    # Parse the keyword and description
-                    tmp = message.split('\n')
-                    keyword = tmp[3]
-                    description = tmp[2]
-                    self.set_keyword_and_description(keyword, description)
-                    self.set_annoucement(2, '')
-                elif "Game ended!" in message:
-                    game_ending_event.set()
-                    lines = message.splitlines()
-
-                    for i in range(len(lines)):
-                        if (i == 0):
-                            self.set_annoucement(i + 1, lines[i], (255, 0, 0))
-                        else: 
-                            self.set_annoucement(i + 1, lines[i])
-                    self.set_annoucement(7, 'Press Y to join the next game or N to exit.', (0, 0, 255))
-                elif "Game is ending" in message:
-                    game_exiting_event.set()
-                    break
-                elif "it's your turn" in message:
-                    player_turn_event.set()
-                elif "You missed your turn." in message or "Waiting for other player's turn..." in message:
-                    player_turn_event.clear()
-                elif "You are out of the game." in message:
-                    player_disqualified_event.set()
-                elif message == "You can only guess the keyword from the 2nd turn." or message == "Invalid guess. Please try again." or message == "This character has been guessed. Please guess again.":
-                    self.set_annoucement(2, message)
-                elif "occurrence" in message:
-                    words = message.split()
-                    keyword = words[len(words) - 1]
-                    message = " ".join(words[i] for i in range(5) if i < len(words))
-                    self.set_keyword_and_description(keyword, self._description)
-                    self.set_annoucement(2, message)
-                elif "is not in the keyword." in message:
-                    self.set_annoucement(2, message)
-                elif "correct keyword" in message:
-                    self.set_annoucement(1, '')
-                    self.set_annoucement(2, message)
-                else:
-                    self.set_annoucement(1, message)
-            except socket.timeout:
-                player_turn_event.clear()
+                data = self._client_socket.recv(4096)
+            except OSError:
+                data = b''
+            if not data:
                 break
+            for message in decoder.feed(data):
+                pygame.event.post(pygame.event.Event(SERVER_MESSAGE, message=message))
+                if message.type == MessageType.GAME_CLOSED:
+                    return
+        pygame.event.post(pygame.event.Event(SERVER_MESSAGE, message=None))
+
+    # Apply one server message on the main thread, returns False once the
+    # server closed the game or went away
+    def dispatch_message(self, message):
+        if message is None:
+            self._game_exiting = True
+            return False
+        print(format_message(message))
+        if message.type == MessageType.NICKNAME_REJECTED:
+            self.set_nickname_input_label(format_message(message))
+        elif message.type == MessageType.REGISTERED:
+            self.set_nickname_input_label('Enter a nickname: ')
+            self._game_state = GameState.WAITING_FOR_START
+            self.show_waiting_room()
+        elif message.type == MessageType.SESSION:
+            self._session_token = message.fields[0]
+        elif message.type == MessageType.GAME_STARTED:
+            self._game_state = GameState.PLAYING
+            self.reset_timer()
+
+            _, description, keyword = message.fields
+            self.set_keyword_and_description(keyword, description)
+            self.set_annoucement(2, '')
+        elif message.type == MessageType.SCORES:
+            self._game_ending = True
+            self.set_annoucement(1, 'Game ended! Points:', (255, 0, 0))
+            for i, (nickname, point) in enumerate(message.fields[0][:5]):
+                self.set_annoucement(i + 2, '{}. {}: {}'.format(i + 1, nickname, point))
+            self.set_annoucement(7, 'Press Y to join the next game or N to exit.', (0, 0, 255))
+        elif message.type == MessageType.GAME_CLOSED:
+            self._game_exiting = True
+            return False
+        elif message.type == MessageType.YOUR_TURN:
+            self._player_turn = True
+        elif message.type in (MessageType.TIMEOUT, MessageType.WAIT_FOR_TURN):
+            self._player_turn = False
+        elif message.type == MessageType.DISQUALIFIED:
+            self._player_disqualified = True
+        elif message.type in (MessageType.KEYWORD_TOO_EARLY, MessageType.INVALID_GUESS, MessageType.ALREADY_GUESSED):
+            self.set_annoucement(2, format_message(message))
+        elif message.type == MessageType.CHARACTER_FOUND:
+            character, occurrences, keyword = message.fields
+            self.set_keyword_and_description(keyword, self._description)
+            self.set_annoucement(2, "Character '{}' has {} occurrence(s).".format(character, occurrences))
+        elif message.type == MessageType.CHARACTER_MISSING:
+            self.set_annoucement(2, format_message(message))
+        elif message.type == MessageType.WINNER:
+            self.set_annoucement(1, '')
+            self.set_annoucement(2, format_message(message))
+        else:
+            self.set_annoucement(1, format_message(message))
+        return True
 
     def set_annoucement(self, index, announcement, color=(0, 0, 0)):
-        if (index == 1):
-            self._annoucement_1 = announcement
-            self._announcement_1_text = font.render(self._annoucement_1, True, color)
-        elif (index == 2):
-            self._annoucement_2 = announcement
-            self._announcement_2_text = font.render(self._annoucement_2, True, (0, 0, 0))
-        elif (index == 3):
-            self._annoucement_3 = announcement
-            self._announcement_3_text = font.render(self._annoucement_3, True, (0, 0, 0))
-        elif (index == 4):
-            self._annoucement_4 = announcement
-            self._announcement_4_text = font.render(self._annoucement_4, True, (0, 0, 0))
-        elif (index == 5):
-            self._annoucement_5 = announcement
-            self._announcement_5_text = font.render(self._annoucement_5, True, (0, 0, 0))
-        elif (index == 6):
-            self._annoucement_6 = announcement
-            self._announcement_6_text = font.render(self._annoucement_6, True, (0, 0, 0))
-        elif (index == 7):
-            self._annoucement_7 = announcement
-            self._announcement_7_text = font.render(self._annoucement_7, True, color)
+        # Only the first and last lines take a colour
+        if index not in (1, 7):
+            color = (0, 0, 0)
+        self._announcement_texts[index - 1] = text_cache.render(announcement, color)
 
     def on_submit_answer(self):
-        self._client_socket.send(self._answer_input_field.value.encode())
+        self._client_socket.sendall(encode(MessageType.GUESS, self._answer_input_field.value))
         self.reset_timer()
         self._answer_input_field.value = ''
 
@@ -254,24 +283,26 @@ class Game:
         if elapsed_time >= self._timer_duration:
             self.on_submit_answer()
 
-        # Display remaining time
-        self._remaining_time = (self._timer_duration - elapsed_time) // 1000 if (self._timer_duration - elapsed_time) // 1000 >= 0 else 0
-        self._timer = font.render('Time remaining: ' + str(self._remaining_time), True, (255, 0, 0))
+        # Display remaining time, the text only changes once a second
+        remaining_time = max(0, (self._timer_duration - elapsed_time) // 1000)
+        if remaining_time != self._remaining_time:
+            self._remaining_time = remaining_time
+            self._timer = text_cache.render('Time remaining: ' + str(remaining_time), (255, 0, 0))
 
     def on_event(self, event):
         if event.type == pygame.QUIT:
             self._running = False
 
-        if event.type == pygame.USEREVENT:
-            pass
+        if event.type == SERVER_MESSAGE:
+            self.dispatch_message(event.message)
 
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_y and self._game_state == GameState.ENDING:
-                self._client_socket.send("y".encode())
+                self._client_socket.sendall(encode(MessageType.VOTE, "y"))
                 self.restart_game()
             elif event.key == pygame.K_n and self._game_state == GameState.ENDING:
-                self._client_socket.send("n".encode())
-                game_exiting_event.set()
+                self._client_socket.sendall(encode(MessageType.VOTE, "n"))
+                self._game_exiting = True
             elif event.key == pygame.K_RETURN:
                 if (self._game_state == GameState.REGISTERING):
                     self.on_submit_nickname(self._nickname_input_field.value)
@@ -285,150 +316,140 @@ class Game:
                 elif (self._game_state == GameState.PLAYING):
                     self.on_submit_answer()
 
-    def on_render(self):
-        self._screen.fill((255, 255, 255))
-        
-        if (self._game_state == GameState.REGISTERING):
-            label_rect = self._nickname_input_label.get_rect()
-            label_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 - 50)
-            self._screen.blit(self._nickname_input_label, label_rect)
+    # What the current state shows, as (slot, surface, center) items
+    def layout(self):
+        center_x = self._width // 2
+        center_y = self._height // 2
+        texts = self._announcement_texts
+        items = []
 
-            input_field_rect = self._nickname_input_field.surface.get_rect()
-            input_field_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2)
-            self._screen.blit(self._nickname_input_field.surface, input_field_rect)
+        if (self._game_state == GameState.REGISTERING):
+            items.append(('nickname_label', self._nickname_input_label, (center_x, center_y - 50)))
+            items.append(('nickname_input', self._nickname_input_field.surface, (center_x, center_y)))
 
         elif (self._game_state == GameState.WAITING_FOR_START):
-            announce_1_rect = self._announcement_1_text.get_rect()
-            announce_1_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2)
-            self._screen.blit(self._announcement_1_text, announce_1_rect)
-
-            announce_2_rect = self._announcement_2_text.get_rect()
-            announce_2_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 50)
-            self._screen.blit(self._announcement_2_text, announce_2_rect)
+            items.append(('announcement_1', texts[0], (center_x, center_y)))
+            items.append(('announcement_2', texts[1], (center_x, center_y + 50)))
 
         elif (self._game_state == GameState.PLAYING):
-            # points_rect = self._points_text.get_rect()
-            # points_rect.center = (self._display_info.current_w // 2, 30)
-            # self._screen.blit(self._points_text, points_rect)
-
-            keyword_rect = self._keyword.get_rect()
-            keyword_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 - 50)
-            self._screen.blit(self._keyword, keyword_rect)
-
-            hint_rect = self._hint.get_rect()
-            hint_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2)
-            self._screen.blit(self._hint, hint_rect)
+            # items.append(('points', self._points_text, (center_x, 30)))
+            items.append(('keyword', self._keyword, (center_x, center_y - 50)))
+            items.append(('hint', self._hint, (center_x, center_y)))
 
             if (self._turn_state == TurnState.PLAYER_TURN):
-                timer_rect = self._timer.get_rect()
-                timer_rect.center = (self._display_info.current_w // 2, 80)
-                self._screen.blit(self._timer, timer_rect)
-
-                answer_label_rect = self._answer_input_label.get_rect()
-                answer_label_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 50)
-                self._screen.blit(self._answer_input_label, answer_label_rect)
+                items.append(('timer', self._timer, (center_x, 80)))
+                items.append(('answer_label', self._answer_input_label, (center_x, center_y + 50)))
+                items.append(('answer_input', self._answer_input_field.surface, (center_x, center_y + 100)))
 
-                input_field_rect = self._answer_input_field.surface.get_rect()
-                input_field_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 100)
-                self._screen.blit(self._answer_input_field.surface, input_field_rect)
-
-            announce_1_rect = self._announcement_1_text.get_rect()
-            announce_1_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 150)
-            self._screen.blit(self._announcement_1_text, announce_1_rect)
-
-            announce_2_rect = self._announcement_2_text.get_rect()
-            announce_2_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 200)
-            self._screen.blit(self._announcement_2_text, announce_2_rect)
+            items.append(('announcement_1', texts[0], (center_x, center_y + 150)))
+            items.append(('announcement_2', texts[1], (center_x, center_y + 200)))
 
         elif (self._game_state == GameState.ENDING):
-            announce_1_rect = self._announcement_1_text.get_rect()
-            announce_1_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 - 150)
-            self._screen.blit(self._announcement_1_text, announce_1_rect)
+            # The scoreboard, one line every 50 pixels
+            for i, text in enumerate(texts):
+                items.append(('announcement_{}'.format(i + 1), text, (center_x, center_y - 150 + 50 * i)))
 
-            announce_2_rect = self._announcement_2_text.get_rect()
-            announce_2_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 - 100)
-            self._screen.blit(self._announcement_2_text, announce_2_rect)
+        return items
 
-            announce_3_rect = self._announcement_3_text.get_rect()
-            announce_3_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 - 50)
-            self._screen.blit(self._announcement_3_text, announce_3_rect)
+    # Redraw only the items that changed since the last frame and push just
+    # their rectangles to the display. Returns the rectangles pushed.
+    def on_render(self):
+        items = {}
+        for slot, surface, center in self.layout():
+            rect = surface.get_rect()
+            rect.center = center
+            items[slot] = (surface, rect)
+
+        if self._drawn is None:
+            self._screen.fill(BACKGROUND)
+            for surface, rect in items.values():
+                self._screen.blit(surface, rect)
+            pygame.display.update()
+            self._drawn = items
+            return [self._screen.get_rect()]
+
+        dirty = []
+        for slot, (surface, rect) in self._drawn.items():
+            if items.get(slot) != (surface, rect):
+                self._screen.fill(BACKGROUND, rect)
+                dirty.append(rect)
+        for slot, item in items.items():
+            surface, rect = item
+            if self._drawn.get(slot) != item or rect.collidelist(dirty) != -1:
+                self._screen.blit(surface, rect)
+                dirty.append(rect)
+        self._drawn = items
+        if dirty:
+            pygame.display.update(dirty)
+        return dirty
 
-            announce_4_rect = self._announcement_4_text.get_rect()
-            announce_4_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2)
-            self._screen.blit(self._announcement_4_text, announce_4_rect)
+    def on_execute(self):
+        while (self._running) :
+            self.on_frame()
 
-            announce_5_rect = self._announcement_5_text.get_rect()
-            announce_5_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 50)
-            self._screen.blit(self._announcement_5_text, announce_5_rect)
+            # Sleep off the rest of the frame instead of spinning
+            self._clock.tick(self._max_fps)
 
-            announce_6_rect = self._announcement_6_text.get_rect()
-            announce_6_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 100)
-            self._screen.blit(self._announcement_6_text, announce_6_rect)
+        self.on_cleanup()
 
-            announce_7_rect = self._announcement_7_text.get_rect()
-            announce_7_rect.center = (self._display_info.current_w // 2, self._display_info.current_h // 2 + 150)
-            self._screen.blit(self._announcement_7_text, announce_7_rect)
+    # One frame: handle input and server messages, then draw what they
+    # changed, so a message shows up in the frame that received it.
+    # Returns the events handled.
+    def on_frame(self):
+        events = pygame.event.get()
+        for event in events:
+            self.on_event(event)
 
-        pygame.display.flip()
- 
-    def on_execute(self):
-        while (self._running) :
-            self.on_render()
+        if (self._game_state == GameState.REGISTERING):
+            self._nickname_input_field.update(events)
+
+        if (self._game_state == GameState.PLAYING):
+            # Start the handler thread only once
+            # if (not self._play_flag):
+            #     print('reach self._play_flag')
+            #     self._play_flag = True
+            #     thread = threading.Thread(target=self.handle_message)
+            #     thread.start()
+            
+            if (self._game_ending):
+                self._game_state = GameState.ENDING
 
-            events = pygame.event.get()
-            for event in events:
-                self.on_event(event)
+            elif (self._player_disqualified):
+                self._turn_state = TurnState.DISQUALIFIED
+                self.set_annoucement(1, 'Incorrect guess! You are out of the game!')
 
-            if (self._game_state == GameState.REGISTERING):
-                self._nickname_input_field.update(events)
+            elif (self._player_turn):
+                self._turn_state = TurnState.PLAYER_TURN
+                self.set_annoucement(1, '')
+                self._answer_input_field.update(events)
+                self.handle_timer()
 
-            # if (self._game_state == GameState.WAITING_FOR_START and not self._wait_flag):
-            if (self._game_state == GameState.WAITING_FOR_START):
-                self.set_annoucement(1, 'Waiting for other players...')
-                self.set_annoucement(2, 'Game will exit automatically if not enough player joins.')
-                # Start the handler thread only once
-                # self._wait_flag = True
-                # thread = threading.Thread(target=self.wait_for_start)
-                # thread.start()
+            else:
+                self._turn_state = TurnState.WAITING
+                self.set_annoucement(1, 'Waiting for other players\' turn...')
 
-            
-            if (self._game_state == GameState.PLAYING):
-                # Start the handler thread only once
-                # if (not self._play_flag):
-                #     print('reach self._play_flag')
-                #     self._play_flag = True
-                #     thread = threading.Thread(target=self.handle_message)
-                #     thread.start()
-                
-                if (game_ending_event.is_set()):
-                    self._game_state = GameState.ENDING
-
-                elif (player_disqualified_event.is_set()):
-                    self._turn_state = TurnState.DISQUALIFIED
-                    self.set_annoucement(1, 'Incorrect guess! You are out of the game!')
-
-                elif (player_turn_event.is_set()):
-                    self._turn_state = TurnState.PLAYER_TURN
-                    self.set_annoucement(1, '')
-                    self._answer_input_field.update(events)
-                    self.handle_timer()
-
-                else:
-                    self._turn_state = TurnState.WAITING
-                    self.set_annoucement(1, 'Waiting for other players\' turn...')
-
-            if (self._game_state == GameState.ENDING):
-                pass
-
-            if (game_exiting_event.is_set()):
-                self._game_state = GameState.EXITING
-
-            if (self._game_state == GameState.EXITING):
-                self._running = False
+        if (self._game_state == GameState.ENDING):
+            pass
 
-        self.on_cleanup()
+        if (self._game_exiting):
+            self._game_state = GameState.EXITING
+
+        if (self._game_state == GameState.EXITING):
+            self._running = False
+        else:
+            self.on_render()
+        return events
 
     def on_cleanup(self):
         pygame.quit()
- 
-game = Game()
\ No newline at end of file
+
+def main():
+    parser = argparse.ArgumentParser(description="The Magical Wheel game client")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    Game(host=args.host, port=args.port).on_execute()
+
+if __name__ == "__main__":
+    main()
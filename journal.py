@@ -0,0 +1,232 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from enum import IntEnum
+
+from protocol import MessageType
+
+# Append-only journal of everything that happens in the rooms, for replaying
+# games when a result is disputed and for analytics.
+#
+# File layout (little-endian):
+#   header  "<4sI"   magic, version
+#   record  "<HBdI"  payload length, record type, unix time, room id,
+#                    followed by the payload fields listed in FIELDS
+# Field kinds are those of protocol.py: B/H/I integers, s (2-byte length
+# prefixed UTF-8) and p (2-byte count of (string, uint32) pairs).
+#
+# Recording costs one struct pack and a deque append on the event loop. A
+# writer thread appends what has accumulated and fsyncs it once per
+# fsync_interval, so a crash loses at most that much. The reader maps the
+# file and skips records it is not asked for without decoding them.
+#
+# Room ids go on from the highest one already in the file, so a restarted
+# server never reuses the id of a game recorded before.
+
+MAGIC = b"MWJL"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sI")
+RECORD_HEADER = struct.Struct("<HBdI")
+FSYNC_INTERVAL = 1.0
+
+class RecordType(IntEnum):
+    GAME_STARTED = 1   # keyword, description
+    GUESS = 2          # nickname, guess, result (the MessageType sent back)
+    TIMEOUT = 3        # nickname
+    PLAYER_LEFT = 4    # nickname
+    SCORES = 5         # (nickname, points) ranked
+
+FIELDS = {
+    RecordType.GAME_STARTED: "ss",
+    RecordType.GUESS: "ssB",
+    RecordType.TIMEOUT: "s",
+    RecordType.PLAYER_LEFT: "s",
+    RecordType.SCORES: "p",
+}
+
+Record = namedtuple("Record", ["type", "time", "room_id", "fields"])
+
+_INTS = {kind: struct.Struct("<" + kind) for kind in "BHI"}
+_LENGTH = _INTS["H"]
+_POINTS = _INTS["I"]
+
+def _encode_string(value, out):
+    data = value.encode()
+    out += _LENGTH.pack(len(data))
+    out += data
+
+def encode_record(record_type, room_id, *fields, now=None):
+    payload = bytearray()
+    for kind, value in zip(FIELDS[record_type], fields):
+        if kind == "s":
+            _encode_string(value, payload)
+        elif kind == "p":
+            payload += _LENGTH.pack(len(value))
+            for name, points in value:
+                _encode_string(name, payload)
+                payload += _POINTS.pack(points)
+        else:
+            payload += _INTS[kind].pack(value)
+    return RECORD_HEADER.pack(len(payload), record_type, time.time() if now is None else now, room_id) + payload
+
+def decode_fields(record_type, data, offset):
+    fields = []
+    for kind in FIELDS[record_type]:
+        if kind == "s" or kind == "p":
+            count, = _LENGTH.unpack_from(data, offset)
+            offset += 2
+            if kind == "s":
+                fields.append(bytes(data[offset:offset + count]).decode())
+                offset += count
+                continue
+            pairs = []
+            for _ in range(count):
+                length, = _LENGTH.unpack_from(data, offset)
+                offset += 2
+                name = bytes(data[offset:offset + length]).decode()
+                offset += length
+                points, = _POINTS.unpack_from(data, offset)
+                offset += 4
+                pairs.append((name, points))
+            fields.append(pairs)
+        else:
+            value, = _INTS[kind].unpack_from(data, offset)
+            offset += _INTS[kind].size
+            fields.append(value)
+    return tuple(fields)
+
+class Journal:
+    def __init__(self, path, fsync_interval=FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._pending = deque()  # appended on the loop, drained by the writer
+        self._stop = threading.Event()
+        self.last_room_id = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = JournalReader(path)
+            try:
+                self.last_room_id, end = reader.last_room()
+            finally:
+                reader.close()
+            if end < os.path.getsize(path):
+                # Drop a record a crash cut short, or the next ones would be unreadable
+                os.truncate(path, end)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+            self._file.flush()
+        self._writer = threading.Thread(target=self._write_behind, daemon=True)
+        self._writer.start()
+
+    def record(self, record_type, room_id, *fields):
+        self._pending.append(encode_record(record_type, room_id, *fields))
+
+    def _drain(self):
+        chunks = []
+        while self._pending:
+            chunks.append(self._pending.popleft())
+        if chunks:
+            self._file.write(b"".join(chunks))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _write_behind(self):
+        while not self._stop.wait(self.fsync_interval):
+            self._drain()
+        self._drain()
+
+    def close(self):
+        self._stop.set()
+        self._writer.join()
+        self._file.close()
+
+class JournalReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < FILE_HEADER.size:
+                raise ValueError("{} is not a game journal".format(path))
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError("{} is not a version {} game journal".format(path, VERSION))
+
+    def __iter__(self):
+        return self.scan()
+
+    # Records in file order, only those of the given types and room if any
+    # are given. With decode=False the fields are left as None, which is all
+    # counting needs. A record cut short by a crash ends the scan.
+    def scan(self, types=None, room_id=None, decode=True):
+        data = self._map
+        end = len(data)
+        offset = FILE_HEADER.size
+        header_size = RECORD_HEADER.size
+        while offset + header_size <= end:
+            length, record_type, timestamp, room = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + header_size
+            offset = start + length
+            if offset > end:
+                return
+            if (types is None or record_type in types) and (room_id is None or room == room_id):
+                record_type = RecordType(record_type)
+                yield Record(record_type, timestamp, room, decode_fields(record_type, data, start) if decode else None)
+
+    # The highest room id in the journal, and the offset where its last
+    # whole record ends
+    def last_room(self):
+        data = self._map
+        end = len(data)
+        offset = FILE_HEADER.size
+        highest = 0
+        while offset + RECORD_HEADER.size <= end:
+            length, _, _, room = RECORD_HEADER.unpack_from(data, offset)
+            if offset + RECORD_HEADER.size + length > end:
+                break
+            offset += RECORD_HEADER.size + length
+            highest = max(highest, room)
+        return highest, offset
+
+    def close(self):
+        self._map.close()
+
+def format_record(record):
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.time))
+    fields = record.fields
+    if record.type == RecordType.GUESS:
+        fields = fields[:2] + (MessageType(fields[2]).name,)
+    return "{} room {:<5} {:<12} {}".format(stamp, record.room_id, record.type.name, " ".join(str(f) for f in fields))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay or summarize a game journal")
+    parser.add_argument("journal")
+    parser.add_argument("--room", type=int, help="only this room")
+    parser.add_argument("--type", action="append", choices=[t.name for t in RecordType], help="only these record types")
+    parser.add_argument("--count", action="store_true", help="count records by type instead of printing them")
+    args = parser.parse_args()
+
+    reader = JournalReader(args.journal)
+    types = {RecordType[name] for name in args.type} if args.type else None
+    try:
+        if args.count:
+            counts = {}
+            started = time.perf_counter()
+            for record in reader.scan(types, args.room, decode=False):
+                counts[record.type] = counts.get(record.type, 0) + 1
+            for record_type, count in sorted(counts.items()):
+                print("{:<12} {}".format(record_type.name, count))
+            print("Scanned in {:.2f}s".format(time.perf_counter() - started))
+        else:
+            for record in reader.scan(types, args.room):
+                print(format_record(record))
+    finally:
+        reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# Compiled keyword database.
+# The text format (a count line followed by keyword/description line pairs)
+# is compiled once into an indexed binary file that the server mmaps and
+# reads entry by entry, so a large dictionary is never materialised.
+# A keyword line may carry a category and a selection weight after tabs:
+#   Python<TAB>programming<TAB>2.5
+# Entries without them are uncategorised (category 0, named "") with weight 1.
+#
+# Layout (little-endian):
+#   header      magic, format version, entry count, category count,
+#               size of the category names, and the mtime (ns) and size of
+#               the text source it was compiled from
+#   offsets     2 * count + 1 uint64 offsets into the string area; entry i is
+#               the keyword between offsets[2i] and offsets[2i+1] and the
+#               description between offsets[2i+1] and offsets[2i+2]
+#   weights     count float32
+#   categories  count uint16 category numbers
+#   strings     packed UTF-8, followed by the category names joined by "\n"
+MAGIC = b"MWKD"
+VERSION = 3
+HEADER = struct.Struct("<4sIIIQqQ")
+OFFSET = struct.Struct("<Q")
+ENTRY = struct.Struct("<3Q")
+COMPILED_SUFFIX = ".kwdb"
+
+class DatabaseError(Exception):
+    pass
+
+def read_count(file, filename):
+    line = file.readline()
+    try:
+        return int(line)
+    except ValueError:
+        raise DatabaseError("{}: expected the number of entries, got {!r}".format(filename, line)) from None
+
+# Yields (keyword, description, category, weight) for every entry
+def iter_text_database(filename):
+    with open(filename, 'r') as file:
+        n = read_count(file, filename)
+        for i in range(n):
+            keyword_line = file.readline()
+            description_line = file.readline()
+            # readline() gives "" only at the end of the file
+            if not description_line:
+                raise DatabaseError("{} declares {} entries but has {}".format(filename, n, i))
+            keyword, *extra = keyword_line.strip().split("\t")
+            if not keyword:
+                raise DatabaseError("{}: entry {} has no keyword".format(filename, i + 1))
+            description = description_line.strip()
+            category = extra[0].strip() if extra else ""
+            try:
+                weight = float(extra[1]) if len(extra) > 1 else 1.0
+            except ValueError:
+                raise DatabaseError("{}: bad weight {!r} for {!r}".format(filename, extra[1], keyword)) from None
+            if weight < 0:
+                raise DatabaseError("{}: negative weight for {!r}".format(filename, keyword))
+            yield keyword, description, category, weight
+
+def compile_database(source, target=None):
+    if target is None:
+        target = os.path.splitext(source)[0] + COMPILED_SUFFIX
+
+    # Taken before reading, so a source replaced while compiling is
+    # compiled again on the next load
+    stat = os.stat(source)
+    with open(source, 'r') as file:
+        count = read_count(file, source)
+    table_size = (2 * count + 1) * OFFSET.size
+
+    # Write next to the target and swap it in, so a server that has the old
+    # file mapped keeps reading a consistent copy
+    tmp = "{}.{}.tmp".format(target, os.getpid())
+    offsets = array("Q", [0])
+    weights = array("f")
+    categories = array("H")
+    category_numbers = {"": 0}
+    try:
+        with open(tmp, "wb") as out:
+            out.seek(HEADER.size + table_size + count * (weights.itemsize + categories.itemsize))
+            position = 0
+            for keyword, description, category, weight in iter_text_database(source):
+                for text in (keyword, description):
+                    data = text.encode()
+                    out.write(data)
+                    position += len(data)
+                    offsets.append(position)
+                weights.append(weight)
+                categories.append(category_numbers.setdefault(category, len(category_numbers)))
+            names = "\n".join(category_numbers).encode()
+            out.write(names)
+            if sys.byteorder != "little":
+                for table in (offsets, weights, categories):
+                    table.byteswap()
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, count, len(category_numbers), len(names),
+                                  stat.st_mtime_ns, stat.st_size))
+            out.write(offsets.tobytes())
+            out.write(weights.tobytes())
+            out.write(categories.tobytes())
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return target
+
+# Read-only view of a compiled database. Entries are decoded on access.
+class KeywordDatabase:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size or self._map[:4] != MAGIC:
+            self._map.close()
+            raise DatabaseError("{} is not a compiled keyword database".format(filename))
+        (magic, version, self._count, category_count, names_size,
+         self.source_mtime, self.source_size) = HEADER.unpack_from(self._map, 0)
+        if version != VERSION:
+            self._map.close()
+            raise DatabaseError("{} is a version {} database, expected {}".format(filename, version, VERSION))
+        self._table = HEADER.size
+        self._weights = self._table + (2 * self._count + 1) * OFFSET.size
+        self._categories = self._weights + self._count * 4
+        self._strings = self._categories + self._count * 2
+        end, = OFFSET.unpack_from(self._map, self._table + 2 * self._count * OFFSET.size)
+        names = self._map[self._strings + end:self._strings + end + names_size].decode()
+        self.categories = names.split("\n") if category_count > 1 else [""]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError("keyword index out of range")
+        start, middle, end = ENTRY.unpack_from(self._map, self._table + 2 * index * OFFSET.size)
+        base = self._strings
+        keyword = self._map[base + start:base + middle].decode()
+        description = self._map[base + middle:base + end].decode()
+        return keyword, description
+
+    def keyword(self, index):
+        return self[index][0]
+
+    def description(self, index):
+        return self[index][1]
+
+    # Selection weight of every entry, as an array of floats
+    def weights(self):
+        weights = array("f")
+        weights.frombytes(self._map[self._weights:self._categories])
+        if sys.byteorder != "little":
+            weights.byteswap()
+        return weights
+
+    # Category number of every entry (an index into self.categories)
+    def category_numbers(self):
+        numbers = array("H")
+        numbers.frombytes(self._map[self._categories:self._strings])
+        if sys.byteorder != "little":
+            numbers.byteswap()
+        return numbers
+
+    def close(self):
+        self._map.close()
+
+_cache = {}
+
+# Load the database for a text source, compiling it unless the compiled copy
+# was made from a source with exactly the same mtime and size (a dictionary
+# deployed with its mtime preserved can be older than the compiled copy).
+# The result is cached per source and reloaded only when the source's mtime
+# or size changes, so calling this at the start
+# of every game is cheap and picks up a new dictionary between games.
+# If a changed source cannot be loaded, the error is logged and the last good
+# database is kept until the source changes again; with nothing loaded yet
+# the error is raised.
+def read_database(filename):
+    cached = _cache.get(filename)
+    stamp = None
+    try:
+        stat = os.stat(filename)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        database = _load_database(filename, stamp)
+    except (DatabaseError, OSError, ValueError) as e:
+        if cached is None:
+            raise
+        print("Keeping the keyword database loaded before, {} could not be loaded: {}".format(filename, e))
+        if stamp is not None:
+            _cache[filename] = (stamp, cached[1])
+        return cached[1]
+    _cache[filename] = (stamp, database)
+    return database
+
+def _load_database(filename, stamp):
+    compiled = os.path.splitext(filename)[0] + COMPILED_SUFFIX
+    try:
+        database = KeywordDatabase(compiled)
+    except FileNotFoundError:
+        database = None
+    except DatabaseError:
+        # Left behind by an older version of this module
+        database = None
+    if database is not None and (database.source_mtime, database.source_size) == stamp:
+        return database
+    if database is not None:
+        database.close()
+    compile_database(filename, compiled)
+    return KeywordDatabase(compiled)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python keyword_db.py <database.txt> [output{}]".format(COMPILED_SUFFIX))
+        sys.exit(1)
+    output = compile_database(*sys.argv[1:])
+    print("Compiled {} entries into {}".format(len(KeywordDatabase(output)), output))
@@ -0,0 +1,142 @@
+import random
+import weakref
+from array import array
+from collections import deque
+
+# Keyword selection for rooms.
+# Each room draws through its own KeywordSelector, which avoids repeating the
+# keywords of its last `window` rounds. Draws cost O(1) however large the
+# database is:
+#   - unweighted pools are a shuffle bag: an incremental Fisher-Yates shuffle
+#     that hands out every keyword once before any comes back, and between
+#     two passes also keeps the window clear of repeats
+#   - weighted pools sample an alias table and redraw a keyword that is still
+#     in the window
+# A pool is the whole database or one category. Its candidate list and alias
+# table are built once per loaded database and shared by all rooms.
+
+DEFAULT_WINDOW = 50
+MAX_REDRAWS = 32
+
+# Walker/Vose alias table: one uniform draw picks a slot, a second picks
+# between the slot's own entry and its alias
+class AliasTable:
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("alias table needs at least one positive weight")
+        self.probability = array("d", [0.0]) * n
+        self.alias = array("I", [0]) * n
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large[-1]
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(large.pop())
+        # Whatever is left is 1 up to rounding
+        for i in large + small:
+            self.probability[i] = 1.0
+
+    def __len__(self):
+        return len(self.probability)
+
+    def sample(self, rng):
+        slot = int(rng.random() * len(self.probability))
+        if rng.random() < self.probability[slot]:
+            return slot
+        return self.alias[slot]
+
+class KeywordPool:
+    def __init__(self, database, category=None):
+        weights = database.weights()
+        if category is None:
+            indexes = None  # the whole database
+            pool_weights = weights
+        else:
+            if category not in database.categories:
+                raise ValueError("no keywords in category {!r}".format(category))
+            number = database.categories.index(category)
+            indexes = array("I", (i for i, c in enumerate(database.category_numbers()) if c == number))
+            pool_weights = [weights[i] for i in indexes]
+        self.indexes = indexes
+        self.size = len(pool_weights)
+        self.weighted = any(w != pool_weights[0] for w in pool_weights)
+        self.table = AliasTable(pool_weights) if self.weighted else None
+
+    def __len__(self):
+        return self.size
+
+    # Database index of the n-th keyword in the pool
+    def entry(self, n):
+        return n if self.indexes is None else self.indexes[n]
+
+_pools = weakref.WeakKeyDictionary()  # database -> {category: KeywordPool}
+
+def get_pool(database, category=None):
+    pools = _pools.setdefault(database, {})
+    pool = pools.get(category)
+    if pool is None:
+        pool = pools[category] = KeywordPool(database, category)
+    return pool
+
+class KeywordSelector:
+    def __init__(self, database, category=None, window=DEFAULT_WINDOW, rng=None):
+        self.database = database
+        self.pool = get_pool(database, category)
+        self.window = min(window, len(self.pool) - 1)
+        self.rng = rng if rng is not None else random.Random()
+        self._recent = deque()
+        self._recent_set = set()
+        # Shuffle bag: positions below _drawn hold what this pass handed out,
+        # _swaps records the positions a partial shuffle has moved
+        self._drawn = 0
+        self._swaps = {}
+
+    # Database index of the next keyword
+    def draw(self):
+        if self.pool.weighted:
+            n = self._draw_weighted()
+        else:
+            n = self._draw_from_bag()
+        self._remember(n)
+        return self.pool.entry(n)
+
+    def _draw_weighted(self):
+        table = self.pool.table
+        n = table.sample(self.rng)
+        for _ in range(MAX_REDRAWS):
+            if n not in self._recent_set:
+                break
+            n = table.sample(self.rng)
+        return n
+
+    def _draw_from_bag(self):
+        size = len(self.pool)
+        if self._drawn == size:
+            # Start the next pass
+            self._drawn = 0
+            self._swaps = {}
+        for _ in range(MAX_REDRAWS):
+            position = self.rng.randrange(self._drawn, size)
+            n = self._swaps.get(position, position)
+            # Only the first draws of a pass can hit the end of the last one
+            if n not in self._recent_set or self._drawn + 1 == size:
+                break
+        self._swaps[position] = self._swaps.get(self._drawn, self._drawn)
+        self._swaps[self._drawn] = n
+        self._drawn += 1
+        return n
+
+    def _remember(self, n):
+        if self.window <= 0:
+            return
+        if len(self._recent) == self.window:
+            self._recent_set.discard(self._recent.popleft())
+        self._recent.append(n)
+        self._recent_set.add(n)
@@ -0,0 +1,222 @@
+import heapq
+import queue
+import sqlite3
+import threading
+import time
+
+from registry import nickname_key
+
+# Cumulative per-nickname statistics kept across games and restarts.
+# The event loop only touches memory: results update an in-memory ranking
+# (a ScoreIndex, so a result and a rank cost O(log S) for scores up to S)
+# and are queued for a writer thread, which adds them to SQLite in batches.
+# Nicknames are compared the same way as in the nickname registry.
+
+FLUSH_INTERVAL = 1.0  # seconds the writer waits to fill a batch
+RETRY_INTERVAL = 5.0  # seconds before a failed batch is written again
+MAX_BATCH = 1000
+INITIAL_SCORES = 1024  # scores the index covers before it first grows
+
+# Players counted by score in a Fenwick tree, with the players of each
+# score in a set. Moving a player and ranking a score cost O(log S); top-K
+# finds each score that has players in O(log S) and orders ties by key.
+class ScoreIndex:
+    def __init__(self):
+        self._tree = [0] * (INITIAL_SCORES + 1)  # 1-based, score s counted at s + 1
+        self._players = {}  # score -> set of nickname keys
+        self.total = 0
+
+    def add(self, key, score):
+        if score + 1 >= len(self._tree):
+            self._grow(score)
+        self._players.setdefault(score, set()).add(key)
+        self._update(score, 1)
+        self.total += 1
+
+    def remove(self, key, score):
+        keys = self._players[score]
+        keys.remove(key)
+        if not keys:
+            del self._players[score]
+        self._update(score, -1)
+        self.total -= 1
+
+    # Position of a score counting ties as equal (1 is best)
+    def rank(self, score):
+        return self.total - self._count_upto(score) + 1
+
+    # Best k as (score, key)
+    def top(self, k):
+        found = []
+        above = 0  # players ranked before the score being looked at
+        while len(found) < k and above < self.total:
+            score = self._nth(self.total - above)
+            keys = self._players[score]
+            found.extend((score, key) for key in heapq.nsmallest(k - len(found), keys))
+            above += len(keys)
+        return found
+
+    def _update(self, score, delta):
+        tree = self._tree
+        i = score + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    # Players with a score of at most score
+    def _count_upto(self, score):
+        tree = self._tree
+        i = min(score + 1, len(tree) - 1)
+        count = 0
+        while i > 0:
+            count += tree[i]
+            i -= i & -i
+        return count
+
+    # Score of the nth lowest player, 1-based
+    def _nth(self, n):
+        tree = self._tree
+        position = 0
+        step = len(tree) - 1  # the size is a power of two
+        while step:
+            i = position + step
+            if i < len(tree) and tree[i] < n:
+                position = i
+                n -= tree[i]
+            step //= 2
+        return position
+
+    # Double the covered scores until score fits, rebuilding the counts
+    def _grow(self, score):
+        size = len(self._tree) - 1
+        while size < score + 1:
+            size *= 2
+        self._tree = [0] * (size + 1)
+        for existing, keys in self._players.items():
+            self._update(existing, len(keys))
+
+class PlayerStats:
+    __slots__ = ("nickname", "points", "games", "wins")
+
+    def __init__(self, nickname, points=0, games=0, wins=0):
+        self.nickname = nickname
+        self.points = points
+        self.games = games
+        self.wins = wins
+
+class Leaderboard:
+    def __init__(self, path):
+        self.path = path
+        self._stats = {}    # nickname key -> PlayerStats
+        self._ranking = ScoreIndex()
+        self._queue = queue.Queue()
+
+        db = self._connect()
+        db.execute("""CREATE TABLE IF NOT EXISTS players (
+                          key TEXT PRIMARY KEY,
+                          nickname TEXT NOT NULL,
+                          points INTEGER NOT NULL DEFAULT 0,
+                          games INTEGER NOT NULL DEFAULT 0,
+                          wins INTEGER NOT NULL DEFAULT 0)""")
+        # Ranking happens in memory, no query ever needed this
+        db.execute("DROP INDEX IF EXISTS players_by_points")
+        db.commit()
+        for key, nickname, points, games, wins in db.execute("SELECT key, nickname, points, games, wins FROM players"):
+            self._stats[key] = PlayerStats(nickname, points, games, wins)
+            self._ranking.add(key, points)
+        db.close()
+
+        self._writer = threading.Thread(target=self._write_behind, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        # WAL lets worker processes share the file; adds are increments, so
+        # concurrent writers never overwrite each other
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def __len__(self):
+        return len(self._stats)
+
+    # Add one finished game: (nickname, points, won) for every player
+    def record_game(self, results):
+        rows = []
+        for nickname, points, won in results:
+            key = nickname_key(nickname)
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = PlayerStats(nickname)
+            else:
+                self._ranking.remove(key, stats.points)
+            stats.nickname = nickname
+            stats.points += points
+            stats.games += 1
+            stats.wins += int(won)
+            self._ranking.add(key, stats.points)
+            rows.append((key, nickname, points, 1, int(won)))
+        self._queue.put(rows)
+
+    # Best k players as (nickname, points)
+    def top(self, k):
+        return [(self._stats[key].nickname, points) for points, key in self._ranking.top(k)]
+
+    # Position of a player counting ties as equal (1 is best), 0 if unknown
+    def rank(self, nickname):
+        stats = self._stats.get(nickname_key(nickname))
+        if stats is None:
+            return 0
+        return self._ranking.rank(stats.points)
+
+    def stats(self, nickname):
+        return self._stats.get(nickname_key(nickname))
+
+    # A failed write (e.g. the file stayed locked past the timeout) is
+    # logged and its rows are written again with the next batch, so the
+    # writer keeps going and nothing is counted twice.
+    def _write_behind(self):
+        db = self._connect()
+        batch = []
+        running = True
+        while running:
+            try:
+                rows = self._queue.get(timeout=RETRY_INTERVAL if batch else None)
+            except queue.Empty:
+                rows = []
+            if rows is None:
+                running = False
+            else:
+                batch.extend(rows)
+                # Gather whatever else arrives shortly after into the same transaction
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                try:
+                    while len(batch) < MAX_BATCH:
+                        rows = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                        if rows is None:
+                            running = False
+                            break
+                        batch.extend(rows)
+                except queue.Empty:
+                    pass
+            if not batch:
+                continue
+            try:
+                with db:
+                    db.executemany("""INSERT INTO players (key, nickname, points, games, wins) VALUES (?, ?, ?, ?, ?)
+                                      ON CONFLICT (key) DO UPDATE SET
+                                          nickname = excluded.nickname,
+                                          points = points + excluded.points,
+                                          games = games + excluded.games,
+                                          wins = wins + excluded.wins""", batch)
+                batch = []
+            except sqlite3.Error as e:
+                print("Leaderboard write of {} results failed: {}".format(len(batch), e))
+        if batch:
+            print("Leaderboard lost {} results that could not be written".format(len(batch)))
+        db.close()
+
+    # Write out everything recorded so far and stop the writer
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
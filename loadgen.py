@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import random
+import resource
+import string
+import time
+
+from connection import DEFAULT_INPUT_BURST, DEFAULT_INPUT_RATE
+from protocol import FrameDecoder, MessageType, encode
+
+# Headless load generator.
+# Opens many simulated players against a running server, plays full games
+# (registration, guesses, Y/N restart vote) and reports connection and game
+# throughput together with per-turn round-trip latency percentiles.
+
+# Most common letters in English first
+FREQUENCY_ORDER = "etaoinshrdlcumwfgypbvkjxqz"
+
+# Replies after which the server asks for the same guess again
+RETRY_GUESS = frozenset((
+    MessageType.ALREADY_GUESSED,
+    MessageType.INVALID_GUESS,
+    MessageType.KEYWORD_TOO_EARLY,
+))
+
+# Server replies that answer a guess, used to time each turn
+TURN_RESULTS = frozenset((
+    MessageType.CHARACTER_FOUND,
+    MessageType.CHARACTER_MISSING,
+    MessageType.ALREADY_GUESSED,
+    MessageType.INVALID_GUESS,
+    MessageType.KEYWORD_TOO_EARLY,
+    MessageType.DISQUALIFIED,
+    MessageType.WINNER,
+))
+
+class Results:
+    def __init__(self):
+        self.connect_times = []
+        self.turn_latencies = []
+        self.registered = 0
+        self.failed = 0
+        self.games = 0.0
+        self.first_connect = None
+        self.last_registered = None
+        self.elapsed = 0.0
+
+def next_guess(strategy, guessed):
+    if strategy == "frequency":
+        for character in FREQUENCY_ORDER:
+            if character not in guessed:
+                return character
+    remaining = [c for c in string.ascii_lowercase if c not in guessed]
+    return random.choice(remaining) if remaining else random.choice(string.ascii_lowercase)
+
+class SimulatedPlayer:
+    def __init__(self, index, args, results):
+        self.index = index
+        self.args = args
+        self.results = results
+        self.decoder = FrameDecoder()
+        self.pending = []
+        self.reader = None
+        self.writer = None
+        self.games_played = 0
+        self.guessed = set()
+        self.tokens = DEFAULT_INPUT_BURST
+        self.refilled = time.perf_counter()
+
+    async def receive(self):
+        while not self.pending:
+            data = await self.reader.read(4096)
+            if not data:
+                return None
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.pop(0)
+
+    # answer is True for the first reply to something the server asked,
+    # which the server's input limit lets through without a token
+    async def send(self, msg_type, *fields, answer=False):
+        if not answer:
+            await self.pace()
+        self.writer.write(encode(msg_type, *fields))
+
+    # Stay within the server's per-connection input limit, like the same
+    # token bucket on this side
+    async def pace(self):
+        rate = self.args.max_rate
+        if rate <= 0:
+            return
+        now = time.perf_counter()
+        self.tokens = min(DEFAULT_INPUT_BURST, self.tokens + (now - self.refilled) * rate)
+        self.refilled = now
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / rate
+            await asyncio.sleep(wait)
+            self.tokens = 1
+            self.refilled = now + wait
+        self.tokens -= 1
+
+    async def think(self):
+        if self.args.think_time > 0:
+            await asyncio.sleep(random.expovariate(1000.0 / self.args.think_time))
+
+    async def register(self):
+        message = await self.receive()
+        if message is None or message.type != MessageType.WELCOME:
+            return False
+        attempt = 0
+        while True:
+            await self.send(MessageType.NICKNAME, "b{}x{}".format(self.index, attempt)[:10], answer=attempt == 0)
+            message = await self.receive()
+            if message is None:
+                return False
+            if message.type == MessageType.REGISTERED:
+                return True
+            attempt += 1
+
+    async def run(self):
+        results = self.results
+        started = time.perf_counter()
+        if results.first_connect is None:
+            results.first_connect = started
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+            results.connect_times.append(time.perf_counter() - started)
+            if not await self.register():
+                results.failed += 1
+                return
+            results.registered += 1
+            results.last_registered = time.perf_counter()
+            await self.play()
+        except OSError:
+            results.failed += 1
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+
+    async def play(self):
+        sent_at = None
+        retry = False
+        while True:
+            message = await self.receive()
+            if message is None or message.type == MessageType.GAME_CLOSED:
+                return
+            if sent_at is not None and message.type in TURN_RESULTS:
+                self.results.turn_latencies.append(time.perf_counter() - sent_at)
+                sent_at = None
+
+            if message.type == MessageType.GAME_STARTED:
+                self.guessed = set()
+            elif message.type == MessageType.CHARACTER_FOUND or message.type == MessageType.CHARACTER_MISSING:
+                self.guessed.add(message.fields[0].lower())
+            elif message.type == MessageType.YOUR_TURN:
+                await self.think()
+                guess = next_guess(self.args.strategy, self.guessed)
+                self.guessed.add(guess)
+                await self.send(MessageType.GUESS, guess, answer=not retry)
+                sent_at = time.perf_counter()
+                retry = False
+            elif message.type in RETRY_GUESS:
+                retry = True
+            elif message.type == MessageType.SCORES:
+                self.games_played += 1
+                self.results.games += 1.0 / max(len(message.fields[0]), 1)
+                await self.think()
+                await self.send(MessageType.VOTE, "y" if self.games_played < self.args.games else "n", answer=True)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def report(results, elapsed):
+    connect_span = (results.last_registered or 0) - (results.first_connect or 0)
+    print("Players registered: {} (failed: {})".format(results.registered, results.failed))
+    if connect_span > 0:
+        print("Connections/sec:    {:.1f}".format(results.registered / connect_span))
+    print("Games completed:    {:.0f} in {:.2f}s ({:.2f} games/sec)".format(results.games, elapsed, results.games / elapsed if elapsed else 0))
+    print("Turns measured:     {}".format(len(results.turn_latencies)))
+    for label, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)):
+        print("Turn latency {}:    {:.2f} ms".format(label, percentile(results.turn_latencies, fraction) * 1000))
+    print("Connect time p99:   {:.2f} ms".format(percentile(results.connect_times, 0.99) * 1000))
+
+async def run_load(args, verbose=True):
+    results = Results()
+    started = time.perf_counter()
+    tasks = []
+    for i in range(args.players):
+        tasks.append(asyncio.create_task(SimulatedPlayer(i, args, results).run()))
+        if args.connect_rate > 0:
+            await asyncio.sleep(1.0 / args.connect_rate)
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks), args.duration or None)
+    except asyncio.TimeoutError:
+        print("Stopped after {}s with games still running".format(args.duration))
+    results.elapsed = time.perf_counter() - started
+    if verbose:
+        report(results, results.elapsed)
+    return results
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive simulated players against a Magical Wheel server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--players", type=int, default=100, help="number of simulated players (use a multiple of the room size)")
+    parser.add_argument("--games", type=int, default=3, help="games each player plays before voting N")
+    parser.add_argument("--strategy", choices=("frequency", "random"), default="frequency")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean think time per turn in ms")
+    parser.add_argument("--connect-rate", type=float, default=0.0, help="new connections per second (0 = as fast as possible)")
+    parser.add_argument("--max-rate", type=float, default=DEFAULT_INPUT_RATE,
+                        help="retries and unasked messages per second each player sends at most, 0 for no limit "
+                             "(default: the server's)")
+    parser.add_argument("--duration", type=float, default=0.0, help="stop after this many seconds (0 = when all games finish)")
+    args = parser.parse_args()
+
+    raise_file_limit()
+    asyncio.run(run_load(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import time
+from collections import deque
+
+# Rating-based matchmaking.
+# Waiting players are kept in buckets of similar rating (average points per
+# game), each a queue in arrival order. A room is formed around the player
+# who has waited longest, from the nearest buckets first. The bucket distance
+# a player accepts grows by one every widen_interval seconds of waiting, so
+# close matches come first, and after max_wait seconds any opponent will do.
+# A newcomer is only matched within its own bucket on arrival, which costs
+# O(room_size); wider matches are left to the periodic match() pass.
+# Cancelled tickets are dropped lazily when they reach the front of a queue,
+# and a bucket goes away with its last waiting player.
+
+BUCKET_WIDTH = 0.5      # rating points per bucket
+WIDEN_INTERVAL = 1.0    # seconds of waiting per extra bucket of tolerance
+MAX_WAIT = 10.0         # seconds after which the rating no longer matters
+MATCH_INTERVAL = 0.5    # how often waiting players are matched again
+DEFAULT_RATING = 0.0    # players without a record
+RECENT_WAITS = 10000    # wait times kept for the percentiles
+
+class Ticket:
+    __slots__ = ("player", "rating", "bucket", "queued_at", "active")
+
+    def __init__(self, player, rating, bucket, queued_at):
+        self.player = player
+        self.rating = rating
+        self.bucket = bucket
+        self.queued_at = queued_at
+        self.active = True
+
+class Matchmaker:
+    def __init__(self, room_size, bucket_width=BUCKET_WIDTH, widen_interval=WIDEN_INTERVAL, max_wait=MAX_WAIT):
+        self.room_size = room_size
+        self.bucket_width = bucket_width
+        self.widen_interval = widen_interval
+        self.max_wait = max_wait
+        self._buckets = {}  # bucket number -> deque of tickets, oldest first
+        self._counts = {}   # bucket number -> active tickets in it
+        self._queue = deque()  # every ticket, oldest first
+        self.waiting = 0
+        self.matched = 0
+        self.wait_times = deque(maxlen=RECENT_WAITS)
+
+    def __len__(self):
+        return self.waiting
+
+    # Queue a player and return (ticket, groups formed right away)
+    def add(self, player, rating, now=None):
+        if now is None:
+            now = time.monotonic()
+        bucket = int(rating // self.bucket_width)
+        ticket = Ticket(player, rating, bucket, now)
+        self._buckets.setdefault(bucket, deque()).append(ticket)
+        self._counts[bucket] = self._counts.get(bucket, 0) + 1
+        self._queue.append(ticket)
+        self.waiting += 1
+        group = self._group_around(ticket, 0)
+        return ticket, [self._take(group, now)] if group is not None else []
+
+    def cancel(self, ticket):
+        if not ticket.active:
+            return
+        ticket.active = False
+        self.waiting -= 1
+        self._counts[ticket.bucket] -= 1
+        if not self._counts[ticket.bucket]:
+            del self._counts[ticket.bucket]
+            del self._buckets[ticket.bucket]
+        # Keep the queue of everyone in proportion to those still waiting
+        if len(self._queue) > 2 * self.waiting + self.room_size:
+            self._queue = deque(t for t in self._queue if t.active)
+
+    # How many buckets away from its own a ticket accepts opponents
+    def tolerance(self, ticket, now):
+        waited = now - ticket.queued_at
+        if waited >= self.max_wait:
+            return max(self._counts) - min(self._counts)
+        return int(waited // self.widen_interval)
+
+    # Form as many groups as the current tolerances allow, oldest players
+    # first. Returns a list of player lists.
+    def match(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        groups = []
+        for ticket in self._queue:
+            if self.waiting < self.room_size:
+                break
+            if not ticket.active:
+                continue
+            group = self._group_around(ticket, self.tolerance(ticket, now))
+            if group is not None:
+                groups.append(self._take(group, now))
+        if len(self._queue) > self.waiting:
+            self._queue = deque(t for t in self._queue if t.active)
+        return groups
+
+    # Take out everyone who has waited at least min_wait seconds, oldest
+    # first, e.g. to seat them with bots
+    def take_waiting(self, min_wait, now=None):
+        if now is None:
+            now = time.monotonic()
+        overdue = []
+        for ticket in self._queue:
+            if now - ticket.queued_at < min_wait:
+                break
+            if ticket.active:
+                overdue.append(ticket)
+        if not overdue:
+            return []
+        players = self._take(overdue, now)
+        self._queue = deque(t for t in self._queue if t.active)
+        return players
+
+    def _group_around(self, anchor, tolerance):
+        counts = self._counts
+        low = anchor.bucket - tolerance
+        high = anchor.bucket + tolerance
+        if tolerance < len(counts):
+            reachable = sum(counts.get(b, 0) for b in range(low, high + 1))
+        else:
+            reachable = sum(count for b, count in counts.items() if low <= b <= high)
+        if reachable < self.room_size:
+            return None
+
+        group = [anchor]
+        for distance in range(tolerance + 1):
+            for bucket in ((anchor.bucket,) if distance == 0 else (anchor.bucket - distance, anchor.bucket + distance)):
+                if not counts.get(bucket):
+                    continue
+                for ticket in self._buckets[bucket]:
+                    if ticket.active and ticket is not anchor:
+                        group.append(ticket)
+                        if len(group) == self.room_size:
+                            return group
+        return None
+
+    def _take(self, group, now):
+        players = []
+        for ticket in group:
+            self.cancel(ticket)
+            self.wait_times.append(now - ticket.queued_at)
+            players.append(ticket.player)
+        self.matched += len(group)
+        # Drop what is no longer waiting from the front of the touched buckets
+        for bucket in {ticket.bucket for ticket in group}:
+            queue = self._buckets.get(bucket)
+            while queue and not queue[0].active:
+                queue.popleft()
+        return players
+
+    # Wait time below which the given fraction of recent matches fell
+    def wait_percentile(self, fraction):
+        if not self.wait_times:
+            return 0.0
+        ordered = sorted(self.wait_times)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
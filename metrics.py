@@ -0,0 +1,124 @@
+import asyncio
+from bisect import bisect_left
+
+# Live server metrics in the Prometheus text exposition format.
+# Instruments are plain counters and fixed-bucket histograms updated in place
+# on the event loop, so recording costs an addition and a bisect. Gauges read
+# their value from a callback when the metrics are scraped.
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+class Gauge:
+    def __init__(self, name, help_text, read, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.kind = kind  # "counter" for running totals kept elsewhere
+
+    def samples(self):
+        yield self.name, self.read()
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{le="{}"}}'.format(self.name, bound), cumulative
+        yield '{}_bucket{{le="+Inf"}}'.format(self.name), self.count
+        yield self.name + "_sum", self.sum
+        yield self.name + "_count", self.count
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, read, kind="gauge"):
+        return self._add(Gauge(name, help_text, read, kind))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+TURN_RESPONSE_TIME = registry.histogram(
+    "magicalwheel_turn_response_seconds", "Time from announcing a turn to receiving the player's guess", WAIT_BUCKETS)
+GUESS_EVALUATION_TIME = registry.histogram(
+    "magicalwheel_guess_evaluation_seconds", "Time to evaluate a guess and queue the replies")
+BROADCAST_TIME = registry.histogram(
+    "magicalwheel_broadcast_seconds", "Time to encode and queue one message for every player in a room")
+RECV_WAIT_TIME = registry.histogram(
+    "magicalwheel_recv_wait_seconds", "Time a read waited for data from a client", WAIT_BUCKETS)
+MATCHMAKING_WAIT_TIME = registry.histogram(
+    "magicalwheel_matchmaking_wait_seconds", "Time a registered player waited to be placed in a room", WAIT_BUCKETS)
+
+# Minimal HTTP endpoint answering GET /metrics
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status = "200 OK"
+            body = registry.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not found\n"
+        writer.write("HTTP/1.1 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status, len(body)).encode() + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host, port):
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    print("Metrics available on http://{}:{}/metrics".format(host, port))
+    return server
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import cProfile
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# On-demand profiling of a running server.
+# The rooms mark their hot sections with `with profiling.phase(name)`. While
+# nothing is being profiled that costs a global lookup and a no-op context
+# manager, so the hooks can stay armed in production. Sections are always
+# synchronous code, so a phase never takes in work of other tasks.
+#
+# An operator can, over the control socket (see ControlServer) or SIGUSR1
+# (to the server; with --workers, to the supervisor for every worker or to
+# one worker's pid for that worker alone):
+#   - run cProfile inside the chosen phases for a bounded window, which
+#     writes one .pstats file per phase
+#   - sample the loop thread's stack for a bounded window, which writes
+#     collapsed stacks with the phase as the root frame, the input of
+#     flamegraph.pl; time outside any phase shows up under "other"
+#   - take tracemalloc snapshots, each one diffed against the previous
+# Files are written to the output directory, named by process id and time.
+
+PHASES = ("registration", "turn", "broadcast", "scoring", "vote")
+DEFAULT_WINDOW = 30.0   # seconds
+MAX_WINDOW = 600.0
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 16
+TOP_ALLOCATIONS = 50
+MODES = ("cprofile", "sample")
+
+class _Idle:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_IDLE = _Idle()
+
+_session = None  # the profiling window in progress, if any
+
+# Mark a synchronous section of the given phase
+def phase(name):
+    if _session is None:
+        return _IDLE
+    return _Section(_session, name)
+
+class _Section:
+    __slots__ = ("session", "name")
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    def __enter__(self):
+        self.session.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.session.exit(self.name)
+        return False
+
+# cProfile switched on only inside the phases asked for. Phases nest (a
+# broadcast during a turn), and only one profiler can be active at a time,
+# so the inner phase pauses the outer one.
+class CProfileSession:
+    def __init__(self, phases):
+        self.profiles = {name: cProfile.Profile() for name in phases}
+        self._stack = []
+
+    def enter(self, name):
+        if self._stack:
+            outer = self.profiles.get(self._stack[-1])
+            if outer is not None:
+                outer.disable()
+        self._stack.append(name)
+        profile = self.profiles.get(name)
+        if profile is not None:
+            profile.enable()
+
+    def exit(self, name):
+        profile = self.profiles.get(self._stack.pop())
+        if profile is not None:
+            profile.disable()
+        if self._stack:
+            outer = self.profiles.get(self._stack[-1])
+            if outer is not None:
+                outer.enable()
+
+    def finish(self, stem):
+        files = []
+        for name, profile in self.profiles.items():
+            if not profile.getstats():
+                continue  # the phase never ran during the window
+            path = "{}-{}.pstats".format(stem, name)
+            profile.dump_stats(path)
+            files.append(path)
+        return files
+
+# A thread that looks at the loop thread's stack every interval seconds.
+# The loop thread keeps the stack of phases it is in; reading the top of a
+# list from another thread is safe under the GIL.
+class SamplingSession:
+    def __init__(self, phases, interval=SAMPLE_INTERVAL):
+        self.phases = set(phases)
+        self.interval = interval
+        self.samples = Counter()
+        self._stack = []
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def enter(self, name):
+        self._stack.append(name)
+
+    def exit(self, name):
+        self._stack.pop()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                return
+            stack = self._stack
+            label = stack[-1] if stack else "other"
+            if label != "other" and label not in self.phases:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            frames.append(label)
+            self.samples[";".join(reversed(frames))] += 1
+
+    def finish(self, stem):
+        self._stop.set()
+        self._thread.join()
+        path = "{}.folded".format(stem)
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write("{} {}\n".format(stack, count))
+        return [path]
+
+class Profiler:
+    def __init__(self, output_dir="."):
+        self.output_dir = output_dir
+        self.mode = None
+        self._timer = None
+        self._snapshot = None
+        self._snapshots = 0
+
+    def _stem(self, kind):
+        return os.path.join(self.output_dir, "{}-{}-{}".format(kind, os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+
+    # Profile the given phases for duration seconds, after which the files
+    # are written out. Raises ValueError for a bad request.
+    def start(self, mode="cprofile", duration=DEFAULT_WINDOW, phases=PHASES):
+        global _session
+        if _session is not None:
+            raise ValueError("already profiling ({})".format(self.mode))
+        if mode not in MODES:
+            raise ValueError("unknown mode {!r}".format(mode))
+        unknown = set(phases) - set(PHASES)
+        if unknown:
+            raise ValueError("unknown phase {!r}".format(unknown.pop()))
+        if not 0 < duration <= MAX_WINDOW:
+            raise ValueError("duration must be between 0 and {} seconds".format(MAX_WINDOW))
+        _session = CProfileSession(phases) if mode == "cprofile" else SamplingSession(phases)
+        self.mode = mode
+        self._timer = asyncio.get_running_loop().call_later(duration, self.stop)
+        print("Profiling {} for {}s ({})".format(", ".join(phases), duration, mode))
+
+    # End the window early or on time. Returns the files written.
+    def stop(self):
+        global _session
+        if _session is None:
+            return []
+        self._timer.cancel()
+        session, _session = _session, None
+        files = session.finish(self._stem(self.mode))
+        self.mode = None
+        print("Profile written to {}".format(", ".join(files) or "nothing, no phase ran"))
+        return files
+
+    # Snapshot the traced allocations, starting tracing on the first call.
+    # Every later snapshot also writes what changed since the previous one.
+    def snapshot(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        self._snapshots += 1
+        stem = "{}-{}".format(self._stem("memory"), self._snapshots)
+        files = ["{}.snapshot".format(stem)]
+        snapshot.dump(files[0])
+        if self._snapshot is not None:
+            path = "{}.diff".format(stem)
+            with open(path, "w") as file:
+                for stat in snapshot.compare_to(self._snapshot, "lineno")[:TOP_ALLOCATIONS]:
+                    file.write("{}\n".format(stat))
+            files.append(path)
+        self._snapshot = snapshot
+        return files
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        self._snapshot = None
+        self._snapshots = 0
+
+    def status(self):
+        profiling = self.mode or "idle"
+        memory = "tracing, {} snapshots".format(self._snapshots) if tracemalloc.is_tracing() else "off"
+        return "profiling {}, memory {}".format(profiling, memory)
+
+    # SIGUSR1 starts a window with the defaults, or ends the one running
+    def toggle(self):
+        if _session is None:
+            self.start()
+        else:
+            self.stop()
+
+# Admin commands over a local Unix socket, one per line:
+#   profile [cprofile|sample] [SECONDS] [PHASE,...]
+#   stop
+#   memory snapshot | memory stop
+#   status
+# Every command is answered with one line starting with "ok" or "error".
+class ControlServer:
+    def __init__(self, profiler, path):
+        self.profiler = profiler
+        self.path = path
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+        os.chmod(self.path, 0o600)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = "ok " + self.execute(line.decode().split())
+                except ValueError as e:
+                    reply = "error {}".format(e)
+                writer.write(reply.encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, words):
+        if not words:
+            raise ValueError("empty command")
+        command, args = words[0], words[1:]
+        profiler = self.profiler
+        if command == "profile":
+            mode = "cprofile"
+            duration = DEFAULT_WINDOW
+            phases = PHASES
+            for arg in args:
+                if arg in MODES:
+                    mode = arg
+                elif arg.replace(".", "", 1).isdigit():
+                    duration = float(arg)
+                else:
+                    phases = tuple(arg.split(","))
+            profiler.start(mode, duration, phases)
+            return "profiling for {}s".format(duration)
+        if command == "stop":
+            return " ".join(profiler.stop())
+        if command == "memory" and args == ["snapshot"]:
+            return " ".join(profiler.snapshot())
+        if command == "memory" and args == ["stop"]:
+            profiler.stop_tracing()
+            return "memory tracing stopped"
+        if command == "status":
+            return profiler.status()
+        raise ValueError("unknown command {!r}".format(" ".join(words)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a profiling command to a running server")
+    parser.add_argument("socket", help="the server's --control-socket path (PATH.N for worker N)")
+    parser.add_argument("command", nargs="+", help="e.g. profile sample 10 turn,broadcast | stop | memory snapshot | status")
+    args = parser.parse_args()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(args.socket)
+        sock.sendall(" ".join(args.command).encode() + b"\n")
+        print(sock.makefile().readline().rstrip())
+
+if __name__ == "__main__":
+    main()
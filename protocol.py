@@ -0,0 +1,241 @@
+import struct
+from collections import namedtuple
+from enum import IntEnum
+
+# Wire format shared by the server and both clients.
+# Every frame is a 2-byte big-endian body length followed by the body, which
+# is a 1-byte message type and the fields listed for that type in FIELDS.
+# Field kinds:
+#   B, H, I  unsigned 8/16/32-bit integer
+#   s        UTF-8 string with a 2-byte length prefix
+#   p        list of (string, uint32) pairs with a 2-byte count prefix
+HEADER = struct.Struct("!H")
+MAX_BODY_SIZE = 0xFFFF
+
+class MessageType(IntEnum):
+    # Server -> client
+    WELCOME = 1
+    NICKNAME_REJECTED = 2
+    REGISTERED = 3
+    WAITING_FOR_PLAYERS = 4
+    GAME_STARTED = 5
+    YOUR_TURN = 6
+    WAIT_FOR_TURN = 7
+    TIMEOUT = 8
+    KEYWORD_TOO_EARLY = 9
+    INVALID_GUESS = 10
+    ALREADY_GUESSED = 11
+    CHARACTER_FOUND = 12
+    CHARACTER_MISSING = 13
+    DISQUALIFIED = 14
+    WINNER = 15
+    SCORES = 16
+    GAME_CLOSED = 17
+    SESSION = 18
+    SNAPSHOT = 19
+    RESUME_REJECTED = 20
+    WATCH_REJECTED = 21
+    LEADERBOARD = 22
+
+    # Client -> server
+    NICKNAME = 64
+    GUESS = 65
+    VOTE = 66
+    RESUME = 67
+    WATCH = 68
+    LEADERBOARD_REQUEST = 69
+
+FIELDS = {
+    MessageType.WELCOME: "s",                # default nickname
+    MessageType.NICKNAME_REJECTED: "",
+    MessageType.REGISTERED: "s",             # nickname
+    MessageType.WAITING_FOR_PLAYERS: "",
+    MessageType.GAME_STARTED: "Hss",         # keyword length, description, mask
+    MessageType.YOUR_TURN: "s",              # nickname
+    MessageType.WAIT_FOR_TURN: "",
+    MessageType.TIMEOUT: "",
+    MessageType.KEYWORD_TOO_EARLY: "",
+    MessageType.INVALID_GUESS: "",
+    MessageType.ALREADY_GUESSED: "",
+    MessageType.CHARACTER_FOUND: "sHs",      # character, occurrences, mask
+    MessageType.CHARACTER_MISSING: "s",      # character
+    MessageType.DISQUALIFIED: "",
+    MessageType.WINNER: "ss",                # nickname, keyword
+    MessageType.SCORES: "p",                 # (nickname, points) ranked
+    MessageType.GAME_CLOSED: "",
+    MessageType.SESSION: "s",                # token to resume with after a dropped connection
+    MessageType.SNAPSHOT: "sssssp",          # phase, player to move, description, mask, guessed characters, scores
+    MessageType.RESUME_REJECTED: "",
+    MessageType.WATCH_REJECTED: "",
+    MessageType.LEADERBOARD: "pII",          # (nickname, points) best first, your rank (0 = unranked), your points
+    MessageType.NICKNAME: "s",
+    MessageType.GUESS: "s",
+    MessageType.VOTE: "s",                   # "y" or "n"
+    MessageType.RESUME: "s",                 # session token, instead of a nickname
+    MessageType.WATCH: "I",                  # room id to spectate, 0 for any game in progress
+    MessageType.LEADERBOARD_REQUEST: "H",    # how many of the best players to list, at any time
+}
+
+Message = namedtuple("Message", ["type", "fields"])
+
+_INTS = {kind: struct.Struct("!" + kind) for kind in "BHI"}
+_LENGTH = _INTS["H"]
+_POINTS = _INTS["I"]
+
+class ProtocolError(Exception):
+    pass
+
+def _encode_string(value, out):
+    data = value.encode()
+    out += _LENGTH.pack(len(data))
+    out += data
+
+def encode(msg_type, *fields):
+    kinds = FIELDS[msg_type]
+    if len(fields) != len(kinds):
+        raise ValueError("{} takes {} field(s), got {}".format(msg_type.name, len(kinds), len(fields)))
+
+    body = bytearray((msg_type,))
+    for kind, value in zip(kinds, fields):
+        if kind == "s":
+            _encode_string(value, body)
+        elif kind == "p":
+            body += _LENGTH.pack(len(value))
+            for name, points in value:
+                _encode_string(name, body)
+                body += _POINTS.pack(points)
+        else:
+            body += _INTS[kind].pack(value)
+
+    if len(body) > MAX_BODY_SIZE:
+        raise ValueError("{} message is too large to frame".format(msg_type.name))
+    return HEADER.pack(len(body)) + body
+
+def _decode_string(body, offset):
+    (length,) = _LENGTH.unpack_from(body, offset)
+    offset += _LENGTH.size
+    end = offset + length
+    if end > len(body):
+        raise ProtocolError("string field runs past the end of the frame")
+    return body[offset:end].decode(), end
+
+def decode(body):
+    try:
+        msg_type = MessageType(body[0])
+    except (IndexError, ValueError):
+        raise ProtocolError("unknown message type")
+
+    fields = []
+    offset = 1
+    try:
+        for kind in FIELDS[msg_type]:
+            if kind == "s":
+                value, offset = _decode_string(body, offset)
+            elif kind == "p":
+                (count,) = _LENGTH.unpack_from(body, offset)
+                offset += _LENGTH.size
+                value = []
+                for _ in range(count):
+                    name, offset = _decode_string(body, offset)
+                    (points,) = _POINTS.unpack_from(body, offset)
+                    offset += _POINTS.size
+                    value.append((name, points))
+            else:
+                (value,) = _INTS[kind].unpack_from(body, offset)
+                offset += _INTS[kind].size
+            fields.append(value)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError("malformed {} message: {}".format(msg_type.name, e))
+
+    if offset != len(body):
+        raise ProtocolError("trailing bytes in {} message".format(msg_type.name))
+    return Message(msg_type, tuple(fields))
+
+# Incremental decoder: feed it whatever recv returned and it hands back every
+# message that is now complete, keeping partial frames for the next call.
+class FrameDecoder:
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        messages = []
+        buffer = self._buffer
+        offset = 0
+        while len(buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer, offset)
+            end = offset + HEADER.size + length
+            if end > len(buffer):
+                break
+            messages.append(decode(bytes(buffer[offset + HEADER.size:end])))
+            offset = end
+        del buffer[:offset]
+        return messages
+
+    def pending(self):
+        return len(self._buffer)
+
+# Human readable text for a message, as shown by the console client
+def format_message(message):
+    t = message.type
+    f = message.fields
+    if t == MessageType.WELCOME:
+        return "Welcome to The Magical Wheel, {}!\nEnter your nickname: ".format(*f)
+    if t == MessageType.NICKNAME_REJECTED:
+        return "Nickname already taken or invalid length. Choose another one: "
+    if t == MessageType.REGISTERED:
+        return "Registration Completed Successfully"
+    if t == MessageType.WAITING_FOR_PLAYERS:
+        return "Waiting for other players..."
+    if t == MessageType.GAME_STARTED:
+        return "Game started!\n{}\n{}\n{}\n".format(*f)
+    if t == MessageType.YOUR_TURN:
+        return "Player {}, it's your turn!\nTry to guess a character or the keyword (You can only guess the keyword from the 2nd turn): ".format(*f)
+    if t == MessageType.WAIT_FOR_TURN:
+        return "Waiting for other player's turn..."
+    if t == MessageType.TIMEOUT:
+        return "Timeout occurred. You missed your turn."
+    if t == MessageType.KEYWORD_TOO_EARLY:
+        return "You can only guess the keyword from the 2nd turn."
+    if t == MessageType.INVALID_GUESS:
+        return "Invalid guess. Please try again."
+    if t == MessageType.ALREADY_GUESSED:
+        return "This character has been guessed. Please guess again."
+    if t == MessageType.CHARACTER_FOUND:
+        return "Character '{}' has {} occurrence(s). Current Word: {}".format(*f)
+    if t == MessageType.CHARACTER_MISSING:
+        return "Character '{}' is not in the keyword.".format(*f)
+    if t == MessageType.DISQUALIFIED:
+        return "Incorrect guess! You are out of the game."
+    if t == MessageType.WINNER:
+        return "Congratulations to {} with the correct keyword: {}".format(*f)
+    if t == MessageType.SCORES:
+        points_message = "Game ended! Points:\n"
+        for i, (nickname, point) in enumerate(f[0]):
+            points_message += "{}. {}: {}\n".format(i + 1, nickname, point)
+        return points_message
+    if t == MessageType.GAME_CLOSED:
+        return "Game is ending. Thank you for playing!"
+    if t == MessageType.SESSION:
+        return "Session token: {}".format(*f)
+    if t == MessageType.SNAPSHOT:
+        phase, turn, description, mask, guessed, points = f
+        snapshot_message = "Rejoined the game.\nHint: {}\nCurrent Word: {}\nGuessed: {}\n".format(description, mask, guessed)
+        if turn:
+            snapshot_message += "It is {}'s turn.\n".format(turn)
+        for i, (nickname, point) in enumerate(points):
+            snapshot_message += "{}. {}: {}\n".format(i + 1, nickname, point)
+        return snapshot_message
+    if t == MessageType.RESUME_REJECTED:
+        return "Could not rejoin the game."
+    if t == MessageType.WATCH_REJECTED:
+        return "There is no such game to watch."
+    if t == MessageType.LEADERBOARD:
+        top, rank, points = f
+        leaderboard_message = "Leaderboard:\n"
+        for i, (nickname, point) in enumerate(top):
+            leaderboard_message += "{}. {}: {}\n".format(i + 1, nickname, point)
+        if rank:
+            leaderboard_message += "Your rank: {} with {} points\n".format(rank, points)
+        return leaderboard_message
+    return " ".join(str(field) for field in f)
@@ -0,0 +1,201 @@
+import asyncio
+import itertools
+import json
+import os
+import selectors
+import socket
+
+# Nickname registry.
+# Nicknames are unique across every room on the server, compared
+# case-insensitively (casefold), and released when their player disconnects.
+# NicknameRegistry serves a single process. With several worker processes the
+# supervisor runs a RegistryServer on a Unix socket and every worker talks to
+# it through a RemoteNicknameRegistry, so reservations stay consistent.
+
+def nickname_key(nickname):
+    return nickname.casefold()
+
+class NicknameRegistry:
+    def __init__(self):
+        self._owners = {}
+
+    def __len__(self):
+        return len(self._owners)
+
+    def try_reserve(self, nickname, owner=None):
+        key = nickname_key(nickname)
+        if key in self._owners:
+            return False
+        self._owners[key] = owner
+        return True
+
+    async def reserve(self, nickname):
+        return self.try_reserve(nickname)
+
+    def release(self, nickname, owner=None):
+        key = nickname_key(nickname)
+        if key in self._owners and self._owners[key] == owner:
+            del self._owners[key]
+
+    def release_owner(self, names, owner):
+        for nickname in names:
+            self.release(nickname, owner)
+
+# Requests and replies are JSON lines:
+#   {"op": "reserve", "id": 7, "nickname": "Alice"}  ->  {"id": 7, "ok": true}
+#   {"op": "release", "nickname": "Alice"}            (no reply)
+class _RegistryClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbound = b""
+        self.outbound = bytearray()
+        self.names = set()
+
+# Registry service for the supervisor's selector loop. Each worker holds one
+# connection; everything a worker reserved is released if that worker dies.
+class RegistryServer:
+    def __init__(self, path):
+        self.path = path
+        self.registry = NicknameRegistry()
+        self._selector = None
+        self._clients = set()
+        if os.path.exists(path):
+            os.remove(path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(socket.SOMAXCONN)
+        self._listener.setblocking(False)
+
+    # Selector keys carry a callback so the owner's loop can dispatch to us
+    def attach(self, selector):
+        self._selector = selector
+        selector.register(self._listener, selectors.EVENT_READ, self._accept)
+
+    def _accept(self, events):
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = _RegistryClient(sock)
+        self._clients.add(client)
+        self._selector.register(sock, selectors.EVENT_READ, lambda events: self._serve(client, events))
+
+    def _serve(self, client, events):
+        if events & selectors.EVENT_WRITE:
+            self._write(client)
+        if not events & selectors.EVENT_READ or client not in self._clients:
+            return
+        try:
+            data = client.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(client)
+            return
+
+        lines = (client.inbound + data).split(b"\n")
+        client.inbound = lines.pop()
+        for line in lines:
+            request = json.loads(line)
+            nickname = request["nickname"]
+            if request["op"] == "reserve":
+                ok = self.registry.try_reserve(nickname, client)
+                if ok:
+                    client.names.add(nickname_key(nickname))
+                client.outbound += json.dumps({"id": request["id"], "ok": ok}).encode() + b"\n"
+            elif request["op"] == "release":
+                self.registry.release(nickname, client)
+                client.names.discard(nickname_key(nickname))
+        self._write(client)
+
+    def _write(self, client):
+        if client.outbound:
+            try:
+                sent = client.sock.send(client.outbound)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self._drop(client)
+                return
+            del client.outbound[:sent]
+        events = selectors.EVENT_READ
+        if client.outbound:
+            events |= selectors.EVENT_WRITE
+        key = self._selector.get_key(client.sock)
+        if key.events != events:
+            self._selector.modify(client.sock, events, key.data)
+
+    def _drop(self, client):
+        self.registry.release_owner(client.names, client)
+        self._clients.discard(client)
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    # A forked worker must not keep the supervisor's sockets open, or the
+    # service would never see the other workers disconnect
+    def close_inherited(self):
+        for client in self._clients:
+            client.sock.close()
+        self._listener.close()
+
+    def close(self):
+        for client in list(self._clients):
+            self._drop(client)
+        if self._selector is not None:
+            self._selector.unregister(self._listener)
+        self._listener.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Worker side of the shared registry, used from the worker's event loop
+class RemoteNicknameRegistry:
+    def __init__(self, path):
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._task = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._task = asyncio.create_task(self._read_replies())
+
+    async def _read_replies(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self._pending.pop(reply["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(reply["ok"])
+        finally:
+            # Without the registry no new nickname can be checked, so refuse them
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(False)
+            self._pending.clear()
+            self._writer.close()
+
+    def _send(self, request):
+        if self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(json.dumps(request).encode() + b"\n")
+        return True
+
+    async def reserve(self, nickname):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        if not self._send({"op": "reserve", "id": request_id, "nickname": nickname}):
+            del self._pending[request_id]
+            return False
+        return await future
+
+    def release(self, nickname, owner=None):
+        self._send({"op": "release", "nickname": nickname})
@@ -1,9 +1,52 @@
+import argparse
+import asyncio
+import itertools
+import os
+import signal
 import socket
-import threading
-import random
-import select
+import secrets
+import tempfile
+import time
+
+import connection
+import profiling
+from bots import BOT_PREFIX, DEFAULT_DIFFICULTY, DEFAULT_THINK_TIME, BotConnection, Guesser, prepare_index
+from connection import (DEFAULT_INPUT_BURST, DEFAULT_INPUT_RATE, DEFAULT_MAX_INBOUND, DEFAULT_MAX_OUTBOUND,
+                        DROPPABLE_MESSAGES, OVERFLOW_DROP, OVERFLOW_POLICIES, Connection)
+from journal import Journal, RecordType
+from keyword_db import DatabaseError, read_database
+from keyword_selector import DEFAULT_WINDOW, KeywordSelector
+from leaderboard import Leaderboard
+from matchmaking import DEFAULT_RATING, MATCH_INTERVAL, Matchmaker
+from metrics import (BROADCAST_TIME, GUESS_EVALUATION_TIME, MATCHMAKING_WAIT_TIME, TURN_RESPONSE_TIME, registry,
+                     start_metrics_server)
+from profiling import ControlServer, Profiler
+from protocol import MessageType, encode
+from registry import NicknameRegistry, RemoteNicknameRegistry
+from spectators import SpectatorFeed
+from supervisor import Supervisor, report_stats
+from timer_wheel import TimerWheel
+
+DATABASE_FILE = "database.txt"
+TURN_TIMEOUT = 60  # seconds a player has to guess
+VOTE_TIMEOUT = 60  # seconds players have to vote on a restart
+SESSION_GRACE = 30  # seconds a dropped player's seat is held for them to resume
+LEADERBOARD_FILE = "leaderboard.db"
+JOURNAL_FILE = "games.journal"
+MAX_LEADERBOARD_SIZE = 100
+BOT_WAIT = 30  # seconds a player waits for people before bots take the empty seats
+
+# Room lifecycle: waiting -> playing -> scoring -> voting -> playing ... -> closed
+PHASE_WAITING = "waiting"  # seated by matchmaking, not started yet
+PHASE_PLAYING = "playing"
+PHASE_SCORING = "scoring"
+PHASE_VOTING = "voting"
+PHASE_CLOSED = "closed"
 
 class Player:
+    __slots__ = ("conn", "addr", "nickname", "points", "guess_count", "active",
+                 "room", "session", "grace", "reconnected")
+
     def __init__(self, conn, addr, nickname):
         self.conn = conn
         self.addr = addr
@@ -11,231 +54,803 @@ class Player:
         self.points = 0
         self.guess_count = 0
         self.active = True
+        self.room = None
+        self.session = None      # token the player can resume with
+        self.grace = None        # timer that ends the session after a drop
+        self.reconnected = None  # future a room waits on while the player is away
 
     def reset(self):
         self.points = 0
         self.guess_count = 0
         self.active = True
 
-def read_database(filename):
-    keywords = []
-    descriptions = []
-    with open(filename, 'r') as file:
-        n = int(file.readline())
-        for _ in range(n):
-            keyword = file.readline().strip()
-            description = file.readline().strip()
-            keywords.append(keyword)
-            descriptions.append(description)
-    return keywords, descriptions
-
-def handle_client(player):
-    global players, keywords, game_running, descriptions, num_players
-    welcome_message = "Welcome to The Magical Wheel, {}!\nEnter your nickname: ".format(player.nickname)
-    player.conn.send(welcome_message.encode())
+    @property
+    def is_bot(self):
+        return isinstance(self.conn, BotConnection)
 
-    nickname_taken = True
-    while nickname_taken:
-        nickname = player.conn.recv(1024).decode().strip()
-        if not any(p.nickname.lower() == nickname.lower() for p in players) and len(nickname) <= 10:
-            player.nickname = nickname
-            nickname_taken = False
-            player.conn.send("Registration Completed Successfully".encode())
-        else:
-            player.conn.send("Nickname already taken or invalid length. Choose another one: ".encode())
+# A single game with its own players and round state.
+# Rooms share nothing, so any number of them can run side by side on the loop.
+# run() drives the room through its phases in a loop: every phase handler
+# returns the next phase, so a room can rematch indefinitely without growing
+# the stack or keeping earlier rounds alive.
+class GameRoom:
+    __slots__ = ("room_id", "num_players", "max_turns", "players", "timers",
+                 "turn_timeout", "vote_timeout", "leaderboard", "journal", "category", "no_repeat",
+                 "selector", "phase", "keyword_round",
+                 "description", "turns", "current_player", "winner", "game_running", "spectators")
 
-    # Player registration completed
-    print("Player {} registered".format(player.nickname))
-    players.append(player)
+    def __init__(self, room_id, num_players, max_turns, timers=None,
+                 turn_timeout=TURN_TIMEOUT, vote_timeout=VOTE_TIMEOUT, leaderboard=None, journal=None,
+                 category=None, no_repeat=DEFAULT_WINDOW):
+        self.room_id = room_id
+        self.num_players = num_players
+        self.max_turns = max_turns
+        self.timers = timers if timers is not None else TimerWheel()
+        self.turn_timeout = turn_timeout
+        self.vote_timeout = vote_timeout
+        self.leaderboard = leaderboard
+        self.journal = journal
+        self.category = category    # only keywords of this category if set
+        self.no_repeat = no_repeat  # rounds before a keyword can come back
+        self.selector = None
+        self.phase = PHASE_WAITING
+        self.players = []
+        self.keyword_round = None
+        self.description = ""
+        self.turns = 0
+        self.current_player = None
+        self.winner = None
+        self.game_running = False
+        self.spectators = SpectatorFeed(self.snapshot)
+
+    def is_full(self):
+        return len(self.players) == self.num_players
+
+    def is_running(self):
+        return self.phase not in (PHASE_WAITING, PHASE_CLOSED)
+
+    # Everything a player rejoining mid-game needs to catch up, as the
+    # fields of one SNAPSHOT message
+    def snapshot(self):
+        keyword_round = self.keyword_round
+        turn = ""
+        if self.phase == PHASE_PLAYING and self.current_player is not None:
+            turn = self.current_player.nickname
+        return (self.phase, turn, self.description, keyword_round.masked_word(),
+                "".join(sorted(keyword_round.guessed)), [(p.nickname, p.points) for p in self.players])
 
-    # Wait until all players have joined
-    if len(players) == num_players:
-        # Load game data
-        keywords, descriptions = read_database("database.txt")
+    def broadcast(self, msg_type, *fields):
+        with profiling.phase("broadcast"):
+            started = time.perf_counter()
+            data = encode(msg_type, *fields)
+            droppable = msg_type in DROPPABLE_MESSAGES
+            for player in self.players:
+                player.conn.send(data, droppable)
+            # Players first; the audience gets the same bytes on its own schedule
+            self.spectators.publish(data)
+            BROADCAST_TIME.observe(time.perf_counter() - started)
 
+    async def run(self):
         # Start the game
-        game_running = True
-        print("Starting game...")
-        start_game()
-    else:
-        waiting_message = "Waiting for other players..."
-        player.conn.send(waiting_message.encode())
-
-def start_game():
-    global players, keywords, game_running, descriptions
-    keyword_idx = random.randint(0, len(keywords) - 1)
-    keyword = keywords[keyword_idx]
-    description = descriptions[keyword_idx]
-    current_word = "*" * len(keyword)
-    guessed_characters = set()  # Set to store guessed characters
-    # Send game start message to all players
-    game_running = True
-    game_start_message = "Game started!\n{}\n{}\n{}\n".format(len(keyword), description, current_word)
-    for player in players:
-        player.conn.send(game_start_message.encode())
-
-    # Game logic
-    turns = 0
-    while game_running and any(p.guess_count < max_turns and p.active for p in players):
-        current_player = players[turns % num_players]
-        if not current_player.active:
-            turns += 1
-            continue
-        # Send turn message to current player
-        turn_message = "Player {}, it's your turn!\nTry to guess a character or the keyword (You can only guess the keyword from the 2nd turn): ".format(current_player.nickname)
+        print("Starting game in room {}...".format(self.room_id))
+        handlers = {
+            PHASE_PLAYING: self.start_game,
+            PHASE_SCORING: self.end_game,
+            PHASE_VOTING: self.collect_votes,
+        }
+        self.phase = PHASE_PLAYING
+        try:
+            while self.phase != PHASE_CLOSED:
+                self.phase = await handlers[self.phase]()
+        finally:
+            # However the room ends, its players are let go
+            self.phase = PHASE_CLOSED
+            self.close()
+
+    # Play one round, then move on to scoring
+    async def start_game(self):
+        # Load game data, picking up a new dictionary if it changed since the last game
+        database = read_database(DATABASE_FILE)
+        if self.selector is None or self.selector.database is not database:
+            self.selector = KeywordSelector(database, self.category, self.no_repeat)
+        keyword, self.description = database[self.selector.draw()]
+        self.keyword_round = KeywordRound(keyword)
+        self.winner = None
+        if self.journal is not None:
+            self.journal.record(RecordType.GAME_STARTED, self.room_id, keyword, self.description)
+        # Send game start message to all players
+        self.game_running = True
+        self.broadcast(MessageType.GAME_STARTED, len(keyword), self.description, self.keyword_round.masked_word())
+
+        # Game logic. A player's input only counts while the room waits for
+        # it; whatever they send out of turn is dropped on arrival.
+        players = self.players
         for player in players:
-            if player == current_player:
-                player.conn.send(turn_message.encode())
-            else:
-                player.conn.send("Waiting for other player's turn...".encode())
+            player.conn.accept_input(False)
+        self.turns = 0
+        asked_turn = None
+        while self.game_running and any(p.guess_count < self.max_turns and p.active for p in players):
+            current_player = players[self.turns % self.num_players]
+            if not current_player.active:
+                self.turns += 1
+                continue
+            self.current_player = current_player
+            # Send turn message to current player
+            for player in players:
+                if player == current_player:
+                    player.conn.send_message(MessageType.YOUR_TURN, current_player.nickname)
+                else:
+                    player.conn.send_message(MessageType.WAIT_FOR_TURN)
+            self.spectators.publish_message(MessageType.YOUR_TURN, current_player.nickname)
+            # Only a new turn is a new question; the same turn again after
+            # an invalid guess is a retry
+            if asked_turn != self.turns:
+                asked_turn = self.turns
+                current_player.conn.ask()
 
-        # Set a timeout for receiving guess
-        current_player.conn.settimeout(60)  # 60 seconds timeout for guess
-        ready_to_read, _, _ = select.select([current_player.conn], [], [], 60)
-        if current_player.conn in ready_to_read:
+            # Wait for the guess without holding up other connections
+            turn_started = time.perf_counter()
             try:
-                guess = current_player.conn.recv(1024).decode().strip()
-            except socket.timeout:
-                current_player.conn.send("Timeout occurred. You missed your turn.".encode())
+                message = await read_from_player(self.timers, current_player, MessageType.GUESS, self.turn_timeout)
+            except asyncio.TimeoutError:
+                current_player.conn.send_message(MessageType.TIMEOUT)
+                if self.journal is not None:
+                    self.journal.record(RecordType.TIMEOUT, self.room_id, current_player.nickname)
+                self.turns += 1
                 current_player.guess_count += 1
-                turns += 1
                 continue
-        else:
-            current_player.conn.send("Timeout occurred. You missed your turn.".encode())
-            turns += 1
-            current_player.guess_count += 1
-            continue
+            if message is None:
+                # Player left for good, skip them for the rest of the game
+                current_player.active = False
+                if self.journal is not None:
+                    self.journal.record(RecordType.PLAYER_LEFT, self.room_id, current_player.nickname)
+                self.turns += 1
+                continue
+            guess = message.fields[0].strip()
+            TURN_RESPONSE_TIME.observe(time.perf_counter() - turn_started)
+
+            with profiling.phase("turn"):
+                evaluation_started = time.perf_counter()
+                result = self.evaluate_guess(current_player, guess)
+                GUESS_EVALUATION_TIME.observe(time.perf_counter() - evaluation_started)
+                if self.journal is not None:
+                    self.journal.record(RecordType.GUESS, self.room_id, current_player.nickname, guess, result)
 
-        if len(guess) > 1:
+        # Game ended
+        self.current_player = None
+        return PHASE_SCORING
+
+    # Apply one guess from the current player and return the reply it got.
+    # The turn only moves on after a character guess; an invalid guess lets
+    # the same player try again.
+    def evaluate_guess(self, current_player, guess):
+        keyword_round = self.keyword_round
+        keyword = keyword_round.keyword
+        if not guess:
+            result = MessageType.INVALID_GUESS
+            current_player.conn.send_message(result)
+        elif len(guess) > 1:
             if len(guess) == len(keyword):
                 if current_player.guess_count > 0:
-                    if guess.lower() == keyword.lower():
-                        game_running = False
+                    if keyword_round.matches(guess):
+                        result = MessageType.WINNER
+                        self.game_running = False
+                        self.winner = current_player
                         current_player.points += 5
-                        end_game_message = "Congratulations to {} with the correct keyword: {}".format(current_player.nickname, keyword)
-                        for player in players:
-                            player.conn.send(end_game_message.encode())
-                        end_game()
-                        break
+                        self.broadcast(MessageType.WINNER, current_player.nickname, keyword)
                     else:
+                        result = MessageType.DISQUALIFIED
                         current_player.active = False  # Player is no longer active
-                        wrong_guess_message = "Incorrect guess! You are out of the game."
-                        current_player.conn.send(wrong_guess_message.encode())
+                        current_player.conn.send_message(MessageType.DISQUALIFIED)
                 else:
-                    current_player.conn.send("You can only guess the keyword from the 2nd turn.".encode()) 
-                    continue
+                    result = MessageType.KEYWORD_TOO_EARLY
+                    current_player.conn.send_message(result)
             else:
-                current_player.conn.send("Invalid guess. Please try again.".encode())
-                continue
+                result = MessageType.INVALID_GUESS
+                current_player.conn.send_message(result)
         else:
-            if guess.lower() in guessed_characters:
-                current_player.conn.send("This character has been guessed. Please guess again.".encode())
-                continue
-            elif guess.lower() in keyword.lower():
-                occurrences = keyword.lower().count(guess.lower())
-                guessed_characters.add(guess.lower())  # Add guessed character to the set
-                current_word = update_current_word(keyword, current_word, guess)
-                if "*" not in current_word:
-                    game_running = False
+            character = guess.lower()
+            if keyword_round.is_guessed(character):
+                current_player.conn.send_message(MessageType.ALREADY_GUESSED)
+                return MessageType.ALREADY_GUESSED
+            occurrences = keyword_round.guess_character(character)
+            if occurrences:
+                if keyword_round.is_solved():
+                    self.game_running = False
+                    self.winner = current_player
                     current_player.points += 5
-                    end_game_message = "Congratulations to {} with the correct keyword: {}".format(current_player.nickname, keyword)
-                    for player in players:
-                        player.conn.send(end_game_message.encode())
-                    end_game()
-                    break
+                    self.broadcast(MessageType.WINNER, current_player.nickname, keyword)
+                    return MessageType.WINNER
                 else:
+                    result = MessageType.CHARACTER_FOUND
                     current_player.points += 1
-                    correct_guess_message = "Character '{}' has {} occurrence(s). Current Word: {}".format(guess, occurrences, current_word)
-                    for player in players:
-                        player.conn.send(correct_guess_message.encode())
+                    self.broadcast(MessageType.CHARACTER_FOUND, guess, occurrences, keyword_round.masked_word())
             else:
-                guessed_characters.add(guess.lower())  # Add guessed character to the set
-                wrong_guess_message = "Character '{}' is not in the keyword.".format(guess)
-                current_player.conn.send(wrong_guess_message.encode())
+                result = MessageType.CHARACTER_MISSING
+                current_player.conn.send_message(MessageType.CHARACTER_MISSING, guess)
+                self.spectators.publish_message(MessageType.CHARACTER_MISSING, guess)
             current_player.guess_count += 1
-            turns += 1
+            self.turns += 1
+        return result
 
-    # Game ended
-    if game_running:
-        end_game()
+    async def end_game(self):
+        self.game_running = False
 
+        with profiling.phase("scoring"):
+            # Calculate and announce points
+            points = [(p.nickname, p.points) for p in self.players]
+            points.sort(key=lambda x: x[1], reverse=True)
 
-def update_current_word(keyword, current_word, guess):
-    updated_word = ""
-    for k, c in zip(keyword, current_word):
-        if k.lower() == guess.lower() or c != "*":
-            updated_word += k
-        else:
-            updated_word += "*"
-    return updated_word
-
-def end_game():
-    global players, game_running
-    game_running = False
-
-    # Calculate and announce points
-    points_message = "Game ended! Points:\n"
-    points = [(p.nickname, p.points) for p in players]
-    points.sort(key=lambda x: x[1], reverse=True)
-    for i, (nickname, point) in enumerate(points):
-        points_message += "{}. {}: {}\n".format(i + 1, nickname, point)
-
-    # Announce points to all players
-    for player in players:
-        player.conn.send(points_message.encode())
-
-    # Prompt players to restart the game
-    # restart_message = "Do you want to restart the game? (Y/N): "
-    # for player in players:
-    #     player.conn.send(restart_message.encode())
-
-    # Check players' responses
-    responses = set()
-    for player in players:
-        response = player.conn.recv(1024).decode().strip().lower()
-        responses.add(response)
-
-    # If no player chooses to restart, start a new game
-    if 'n' not in responses:
-        for player in players:
-            player.reset()
-        start_game()
-    else:
+            # Announce points to all players, and take their votes from now on
+            for player in self.players:
+                player.conn.accept_input(True)
+                player.conn.ask()
+            self.broadcast(MessageType.SCORES, points)
+            if self.journal is not None:
+                self.journal.record(RecordType.SCORES, self.room_id, points)
+            if self.leaderboard is not None:
+                self.leaderboard.record_game([(p.nickname, p.points, p is self.winner)
+                                              for p in self.players if not p.is_bot])
+        return PHASE_VOTING
+
+    # Another round if every player votes yes, otherwise the room closes
+    async def collect_votes(self):
+        # Check players' responses. Everyone votes against the same deadline,
+        # and a player who does not vote in time counts as a no.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.vote_timeout
+        responses = set()
+        for player in self.players:
+            try:
+                message = await read_from_player(self.timers, player, MessageType.VOTE, deadline - loop.time())
+            except asyncio.TimeoutError:
+                message = None
+            with profiling.phase("vote"):
+                response = message.fields[0].strip().lower() if message else "n"
+                responses.add(response)
+
+        # If no player chooses to restart, start a new game
+        with profiling.phase("vote"):
+            if 'n' not in responses:
+                for player in self.players:
+                    player.reset()
+                return PHASE_PLAYING
+        return PHASE_CLOSED
+
+    def close(self):
         # Notify players that the game is ending
-        disconnect_message = "Game is ending. Thank you for playing!"
-        for player in players:
-            player.conn.send(disconnect_message.encode())
+        for player in self.players:
+            player.conn.send_message(MessageType.GAME_CLOSED)
             player.conn.close()
-        players.clear()
+        self.players.clear()
+        self.spectators.close()
 
-def main():
-    global players, num_players, max_turns, game_running
-    host = "localhost"
-    port = 5555
 
-    players = []
-    keywords = []
-    num_players = 2
-    max_turns = 5
-    game_running = False
+# Everything a round needs to answer guesses, built once when the keyword is
+# chosen. A character guess costs time proportional to its occurrences, so
+# long phrases are as cheap to play as single words.
+class KeywordRound:
+    __slots__ = ("keyword", "lowered", "positions", "mask", "hidden", "guessed")
+
+    def __init__(self, keyword):
+        self.keyword = keyword
+        self.lowered = keyword.lower()
+        self.positions = {}  # lowercased character -> indexes in the keyword
+        self.mask = []
+        self.hidden = 0
+        self.guessed = set()  # Set to store guessed characters
+        for i, k in enumerate(keyword):
+            if k.isspace():
+                # Nothing to guess between the words of a phrase
+                self.mask.append(k)
+            else:
+                self.mask.append("*")
+                self.hidden += 1
+                self.positions.setdefault(k.lower(), []).append(i)
+
+    def is_guessed(self, character):
+        return character in self.guessed
+
+    # Reveal a lowercased character and return how many times it occurs
+    def guess_character(self, character):
+        self.guessed.add(character)
+        positions = self.positions.pop(character, ())
+        for i in positions:
+            self.mask[i] = self.keyword[i]
+        self.hidden -= len(positions)
+        return len(positions)
+
+    def matches(self, guess):
+        return guess.lower() == self.lowered
+
+    def is_solved(self):
+        return self.hidden == 0
+
+    def masked_word(self):
+        return "".join(self.mask)
+
+# Queues registered players for matchmaking and starts every room it forms
+# on its own task. Players are matched by rating, see matchmaking.py.
+class Lobby:
+    def __init__(self, num_players, max_turns, nicknames=None, turn_timeout=TURN_TIMEOUT,
+                 vote_timeout=VOTE_TIMEOUT, session_grace=SESSION_GRACE, leaderboard=None, journal=None,
+                 category=None, no_repeat=DEFAULT_WINDOW, bot_wait=BOT_WAIT, bot_difficulty=DEFAULT_DIFFICULTY,
+                 bot_think_time=DEFAULT_THINK_TIME):
+        self.num_players = num_players
+        self.max_turns = max_turns
+        self.nicknames = nicknames if nicknames is not None else NicknameRegistry()
+        # One wheel serves the deadlines of every room, see timer_wheel.py
+        self.timers = TimerWheel()
+        self.turn_timeout = turn_timeout
+        self.vote_timeout = vote_timeout
+        self.session_grace = session_grace
+        self.leaderboard = leaderboard
+        self.journal = journal
+        self.category = category
+        self.no_repeat = no_repeat
+        self.bot_wait = bot_wait  # 0 never seats bots
+        self.bot_difficulty = bot_difficulty
+        self.bot_think_time = bot_think_time
+        self._bot_ids = itertools.count(1)
+        self.sessions = {}  # token -> Player
+        self.rooms = {}
+        # Journalled games keep their room ids unique across restarts
+        self._room_ids = itertools.count(1 if journal is None else journal.last_room_id + 1)
+        self._watchers = {}
+        self._tickets = {}  # queued player -> matchmaking ticket
+        self.matchmaker = Matchmaker(num_players)
+        self._match_timer = None
+
+    def _new_room(self):
+        return GameRoom(next(self._room_ids), self.num_players, self.max_turns,
+                        self.timers, self.turn_timeout, self.vote_timeout, self.leaderboard, self.journal,
+                        self.category, self.no_repeat)
+
+    def next_default_nickname(self):
+        return "Player{}".format(self.matchmaker.waiting + 1)
+
+    # Average points per game so far, which is what players are matched on
+    def rating(self, nickname):
+        if self.leaderboard is not None:
+            stats = self.leaderboard.stats(nickname)
+            if stats is not None and stats.games:
+                return stats.points / stats.games
+        return DEFAULT_RATING
+
+    # Queue a player for a room. Returns the room if one could be formed
+    # right away, None while the player waits for opponents.
+    def join(self, player):
+        ticket, groups = self.matchmaker.add(player, self.rating(player.nickname))
+        self._tickets[player] = ticket
+        self._start_rooms(groups)
+        if player.room is None:
+            self._watchers[player] = asyncio.create_task(self._watch(player))
+            self._schedule_matching()
+        return player.room
+
+    def _start_rooms(self, groups):
+        now = time.monotonic()
+        for players in groups:
+            room = self._new_room()
+            for player in players:
+                MATCHMAKING_WAIT_TIME.observe(now - self._tickets.pop(player).queued_at)
+                # Stop watching the player before the room starts reading from them
+                watcher = self._watchers.pop(player, None)
+                if watcher is not None:
+                    watcher.cancel()
+                player.room = room
+                room.players.append(player)
+            while not room.is_full():
+                bot = self._new_bot()
+                bot.room = room
+                room.players.append(bot)
+            self.rooms[room.room_id] = room
+            task = asyncio.create_task(room.run())
+            task.add_done_callback(lambda _, room_id=room.room_id: self.rooms.pop(room_id, None))
+
+    # A player played by the server, see bots.py
+    def _new_bot(self):
+        guesser = Guesser(lambda: read_database(DATABASE_FILE), self.bot_difficulty, category=self.category)
+        nickname = "{}{}".format(BOT_PREFIX, next(self._bot_ids))
+        return Player(BotConnection(guesser, self.bot_think_time), None, nickname)
+
+    # Tolerances widen while players wait, so look again every MATCH_INTERVAL
+    # for as long as anybody is queued
+    def _schedule_matching(self):
+        if self._match_timer is None:
+            self._match_timer = self.timers.schedule(MATCH_INTERVAL, self._match_waiting)
+
+    def _match_waiting(self):
+        self._match_timer = None
+        self._start_rooms(self.matchmaker.match())
+        if self.bot_wait:
+            # Whoever is still alone after bot_wait seconds plays with bots
+            lonely = self.matchmaker.take_waiting(self.bot_wait)
+            self._start_rooms([lonely[i:i + self.num_players] for i in range(0, len(lonely), self.num_players)])
+        if self.matchmaker.waiting:
+            self._schedule_matching()
+
+    # Take a player who leaves while queued out of matchmaking, which ends
+    # their session and frees the nickname. Input sent before the game starts
+    # is ignored.
+    async def _watch(self, player):
+        player.conn.accept_input(False)
+        while await player.conn.read_message() is not None:
+            pass
+        self._watchers.pop(player, None)
+        ticket = self._tickets.pop(player, None)
+        if ticket is not None:
+            self.matchmaker.cancel(ticket)
+
+    # Let a connection ask for the leaderboard whatever else it is doing
+    def serve_requests(self, player, conn):
+        conn.request_handlers[MessageType.LEADERBOARD_REQUEST] = lambda message: self.send_leaderboard(player, message)
+
+    def send_leaderboard(self, player, message):
+        if self.leaderboard is None:
+            player.conn.send_message(MessageType.LEADERBOARD, [], 0, 0)
+            return
+        count = min(message.fields[0], MAX_LEADERBOARD_SIZE)
+        rank = 0
+        points = 0
+        if player.session is not None:
+            stats = self.leaderboard.stats(player.nickname)
+            if stats is not None:
+                rank = self.leaderboard.rank(player.nickname)
+                points = stats.points
+        player.conn.send_message(MessageType.LEADERBOARD, self.leaderboard.top(count), rank, points)
+
+    # Add a read-only spectator to a game in progress, any game for room_id 0
+    def watch(self, room_id, conn):
+        room = self.rooms.get(room_id)
+        if room_id == 0:
+            room = next((r for r in self.rooms.values() if r.is_running()), None)
+        if room is None or not room.is_running():
+            return False
+        room.spectators.add(conn)
+        return True
+
+    # Sessions. A registered player gets a token; if their connection drops
+    # while their room is playing, the seat (and nickname) is held for
+    # session_grace seconds and the room simply waits for them like for a
+    # slow player. Resuming swaps in the new connection and sends one
+    # SNAPSHOT of the room. Anywhere else a drop ends the session at once.
+    def open_session(self, player):
+        player.session = secrets.token_urlsafe(16)
+        self.sessions[player.session] = player
+        conn = player.conn
+        conn.add_close_callback(lambda: self._disconnected(player, conn))
+        return player.session
+
+    def _disconnected(self, player, conn):
+        if player.conn is not conn:
+            return  # an old connection the player already resumed from
+        if player.session is not None and player.room is not None and player.room.is_running():
+            player.grace = self.timers.schedule(self.session_grace, lambda: self.end_session(player))
+        else:
+            self.end_session(player)
+
+    def end_session(self, player):
+        if player.grace is not None:
+            player.grace.cancel()
+            player.grace = None
+        if player.session is None:
+            return
+        del self.sessions[player.session]
+        player.session = None
+        # The nickname is free again once its player is gone for good
+        self.nicknames.release(player.nickname)
+        if player.reconnected is not None and not player.reconnected.done():
+            player.reconnected.set_result(False)
+
+    # Move a player onto a new connection. Returns False if the token is
+    # unknown or the game it belonged to is over.
+    def resume(self, token, conn):
+        player = self.sessions.get(token)
+        if player is None or player.room is None or not player.room.is_running():
+            return False
+        if player.grace is not None:
+            player.grace.cancel()
+            player.grace = None
+        old_conn = player.conn
+        player.conn = conn
+        conn.add_close_callback(lambda: self._disconnected(player, conn))
+        self.serve_requests(player, conn)
+        conn.accept_input(False)  # until the room asks the player for something
+        # The old connection may still look open if it died without a FIN
+        old_conn.abort()
+        conn.send_message(MessageType.SNAPSHOT, *player.room.snapshot())
+        if player.reconnected is not None and not player.reconnected.done():
+            player.reconnected.set_result(True)
+        print("Player {} resumed".format(player.nickname))
+        return True
+
+# Skip anything that is not the kind of message the game is waiting for.
+# Returns None if the connection closes first.
+async def read_message_of_type(conn, msg_type):
+    while True:
+        message = await conn.read_message()
+        if message is None or message.type == msg_type:
+            return message
+
+# Next msg_type message from a player within timeout seconds, following
+# them onto a new connection if they drop and resume their session in time.
+# Raises asyncio.TimeoutError when the time is up, returns None once the
+# player is gone for good.
+async def read_from_player(timers, player, msg_type, timeout):
+    def expire():
+        player.conn.expire_read()
+        if player.reconnected is not None and not player.reconnected.done():
+            player.reconnected.set_exception(asyncio.TimeoutError())
+
+    deadline = timers.schedule(timeout, expire)
+    try:
+        while True:
+            conn = player.conn
+            conn.accept_input(True)
+            try:
+                message = await read_message_of_type(conn, msg_type)
+            finally:
+                conn.clear_read_deadline()
+                conn.accept_input(False)
+            if message is not None or player.session is None:
+                return message
+            if player.conn is conn:
+                # Wait for the player to come back while the session lasts
+                player.reconnected = asyncio.get_running_loop().create_future()
+                try:
+                    if not await player.reconnected:
+                        return None
+                finally:
+                    player.reconnected = None
+    finally:
+        deadline.cancel()
+
+async def handle_client(lobby, player):
+    lobby.serve_requests(player, player.conn)
+    player.conn.send_message(MessageType.WELCOME, player.nickname)
+
+    nickname_taken = True
+    while nickname_taken:
+        message = await player.conn.read_message()
+        if message is None:
+            player.conn.close()
+            return
+        if message.type == MessageType.RESUME:
+            # A player coming back to a game in progress on a new connection
+            if lobby.resume(message.fields[0], player.conn):
+                return
+            player.conn.send_message(MessageType.RESUME_REJECTED)
+            continue
+        if message.type == MessageType.WATCH:
+            if lobby.watch(message.fields[0], player.conn):
+                # Nothing a spectator sends matters, just notice when they leave
+                player.conn.accept_input(False)
+                while await player.conn.read_message() is not None:
+                    pass
+                return
+            player.conn.send_message(MessageType.WATCH_REJECTED)
+            continue
+        if message.type != MessageType.NICKNAME:
+            continue
+        nickname = message.fields[0].strip()
+        if 0 < len(nickname) <= 10 and not nickname.startswith(BOT_PREFIX) and await lobby.nicknames.reserve(nickname):
+            with profiling.phase("registration"):
+                player.nickname = nickname
+                nickname_taken = False
+                player.conn.send_message(MessageType.REGISTERED, nickname)
+                player.conn.send_message(MessageType.SESSION, lobby.open_session(player))
+        else:
+            player.conn.send_message(MessageType.NICKNAME_REJECTED)
+
+    # Player registration completed
+    print("Player {} registered".format(player.nickname))
+    with profiling.phase("registration"):
+        # The room starts by itself once matchmaking has found the opponents
+        if lobby.join(player) is None:
+            player.conn.send_message(MessageType.WAITING_FOR_PLAYERS)
+
+def server_stats(lobby):
+    totals = connection.outbound_totals
+    inbound = connection.inbound_totals
+    return {
+        "pid": os.getpid(),
+        "connections": connection.open_connections,
+        "rooms": len(lobby.rooms),
+        "waiting_players": lobby.matchmaker.waiting,
+        "bytes_queued": totals.bytes_queued,
+        "bytes_pending": totals.bytes_pending,
+        "messages_dropped": totals.messages_dropped,
+        "overflow_disconnects": totals.overflow_disconnects,
+        "messages_throttled": inbound.messages_throttled,
+        "messages_discarded": inbound.messages_discarded,
+        "flood_disconnects": inbound.flood_disconnects,
+    }
+
+def register_server_metrics(lobby):
+    totals = connection.outbound_totals
+    inbound = connection.inbound_totals
+    registry.gauge("magicalwheel_connected_players", "Open client connections",
+                   lambda: connection.open_connections)
+    registry.gauge("magicalwheel_active_rooms", "Rooms with a game in progress",
+                   lambda: len(lobby.rooms))
+    registry.gauge("magicalwheel_waiting_players", "Players queued for matchmaking",
+                   lambda: lobby.matchmaker.waiting)
+    registry.gauge("magicalwheel_spectators", "Spectators watching a game",
+                   lambda: sum(len(room.spectators) for room in lobby.rooms.values()))
+    registry.gauge("magicalwheel_outbound_queued_bytes", "Bytes queued for clients but not yet written",
+                   lambda: totals.bytes_pending)
+    registry.gauge("magicalwheel_outbound_bytes_total", "Bytes queued for clients since start",
+                   lambda: totals.bytes_queued, kind="counter")
+    registry.gauge("magicalwheel_outbound_dropped_messages_total", "Droppable messages discarded for slow clients",
+                   lambda: totals.messages_dropped, kind="counter")
+    registry.gauge("magicalwheel_outbound_overflow_disconnects_total", "Clients disconnected for not reading",
+                   lambda: totals.overflow_disconnects, kind="counter")
+    registry.gauge("magicalwheel_outbound_blocked_seconds_total", "Time sockets spent waiting to become writable",
+                   lambda: totals.blocked_time, kind="counter")
+    registry.gauge("magicalwheel_inbound_messages_total", "Messages received from clients",
+                   lambda: inbound.messages_received, kind="counter")
+    registry.gauge("magicalwheel_inbound_throttled_messages_total", "Client messages dropped by the rate limit",
+                   lambda: inbound.messages_throttled, kind="counter")
+    registry.gauge("magicalwheel_inbound_discarded_messages_total", "Client messages dropped for arriving out of turn",
+                   lambda: inbound.messages_discarded, kind="counter")
+    registry.gauge("magicalwheel_inbound_flood_disconnects_total", "Clients disconnected for flooding the server",
+                   lambda: inbound.flood_disconnects, kind="counter")
+
+async def report_stats_periodically(lobby, stats_fd, interval):
+    while True:
+        report_stats(stats_fd, server_stats(lobby))
+        await asyncio.sleep(interval)
+
+async def serve(host, port, lobby, max_outbound=DEFAULT_MAX_OUTBOUND, overflow_policy=OVERFLOW_DROP,
+                reuse_port=False, stats_fd=None, stats_interval=1.0, max_inbound=DEFAULT_MAX_INBOUND,
+                input_rate=DEFAULT_INPUT_RATE, input_burst=DEFAULT_INPUT_BURST):
+    loop = asyncio.get_running_loop()
 
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Let every worker process accept on the same port
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server.bind((host, port))
-    server.listen()
+    server.listen(socket.SOMAXCONN)
+    server.setblocking(False)
 
-    print("Server started on {}:{}".format(host, port))
+    print("Server started on {}:{} (pid {})".format(host, port, os.getpid()))
+    lobby.timers.start()
 
+    # Every connection is served by a task on this single loop
+    tasks = set()
+    if stats_fd is not None:
+        reporter = asyncio.create_task(report_stats_periodically(lobby, stats_fd, stats_interval))
+        tasks.add(reporter)
     while True:
-        conn, addr = server.accept()
+        sock, addr = await loop.sock_accept(server)
         print("Connected to {}:{}".format(addr[0], addr[1]))
+        conn = Connection(sock, addr, max_outbound, overflow_policy, max_inbound, input_rate, input_burst)
 
-        if len(players) < num_players:
-            nickname = "Player{}".format(len(players) + 1)
-            player = Player(conn, addr, nickname)
-            thread = threading.Thread(target=handle_client, args=(player,))
-            thread.start()
-        else:
-            conn.send("The game is full. Please try again later.\n".encode())
+        player = Player(conn, addr, lobby.next_default_nickname())
+        task = asyncio.create_task(handle_client(lobby, player))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+def main():
+    parser = argparse.ArgumentParser(description="The Magical Wheel game server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes sharing the port (default: 1, no supervisor)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve Prometheus metrics on this local port, worker N uses port + N (default: off)")
+    parser.add_argument("--turn-timeout", type=float, default=TURN_TIMEOUT, help="seconds a player has to make a guess")
+    parser.add_argument("--vote-timeout", type=float, default=VOTE_TIMEOUT, help="seconds players have to vote on a restart")
+    parser.add_argument("--leaderboard", default=LEADERBOARD_FILE,
+                        help="SQLite file with the cumulative leaderboard, empty to disable (default: %(default)s)")
+    parser.add_argument("--journal", default=JOURNAL_FILE,
+                        help="append-only game journal, worker N writes PATH.N, empty to disable (default: %(default)s)")
+    parser.add_argument("--category", help="only play keywords of this database category")
+    parser.add_argument("--no-repeat", type=int, default=DEFAULT_WINDOW,
+                        help="rounds a room plays before a keyword can come up again (default: %(default)s)")
+    parser.add_argument("--session-grace", type=float, default=SESSION_GRACE,
+                        help="seconds a dropped player's seat is held for them to resume")
+    parser.add_argument("--bots-after", type=float, default=BOT_WAIT,
+                        help="seconds a player waits for people before bots fill the room, 0 for no bots (default: %(default)s)")
+    parser.add_argument("--bot-difficulty", type=float, default=DEFAULT_DIFFICULTY,
+                        help="from 0 (guesses blindly) to 1 (plays the best letter every turn)")
+    parser.add_argument("--bot-think-time", type=float, default=DEFAULT_THINK_TIME,
+                        help="mean seconds a bot takes to answer")
+    parser.add_argument("--control-socket",
+                        help="Unix socket taking profiling commands, worker N uses PATH.N (default: off), see profiling.py")
+    parser.add_argument("--profile-dir", default=".", help="where profiles and memory snapshots are written")
+    parser.add_argument("--max-outbound", type=int, default=DEFAULT_MAX_OUTBOUND,
+                        help="bytes buffered per client before the overflow policy applies (default: %(default)s)")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=OVERFLOW_DROP,
+                        help="what to do when a client's buffer is full: drop messages it can miss, or "
+                             "disconnect it (default: %(default)s)")
+    parser.add_argument("--input-rate", type=float, default=DEFAULT_INPUT_RATE,
+                        help="messages per second a client may send on average, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--input-burst", type=int, default=DEFAULT_INPUT_BURST,
+                        help="messages a client may send at once (default: %(default)s)")
+    args = parser.parse_args()
+    if args.max_outbound <= 0:
+        parser.error("--max-outbound must be positive")
+    if args.category is not None:
+        # Every room would fail to start
+        try:
+            categories = read_database(DATABASE_FILE).categories
+        except (DatabaseError, OSError) as e:
+            parser.error("cannot check --category: {}".format(e))
+        if args.category not in categories:
+            parser.error("no keywords in category {!r}, the database has: {}".format(
+                args.category, ", ".join(repr(c) for c in categories if c) or "no categories"))
+
+    host = args.host
+    port = args.port
+    num_players = 2
+    max_turns = 5
+    max_inbound = DEFAULT_MAX_INBOUND  # bytes of a frame a client may have half sent
+
+    # Nicknames are checked against the supervisor's registry when there are workers
+    registry_path = os.path.join(tempfile.gettempdir(), "magical-wheel-{}.sock".format(os.getpid()))
+
+    # Each worker hosts its own lobby and rooms
+    async def run_worker_async(slot, stats_fd):
+        nicknames = None
+        if stats_fd is not None:
+            nicknames = RemoteNicknameRegistry(registry_path)
+            await nicknames.connect()
+        leaderboard = Leaderboard(args.leaderboard) if args.leaderboard else None
+        journal = None
+        if args.journal:
+            # One file per process, so records never interleave
+            journal = Journal(args.journal if slot is None else "{}.{}".format(args.journal, slot))
+        lobby = Lobby(num_players, max_turns, nicknames, args.turn_timeout, args.vote_timeout,
+                      args.session_grace, leaderboard, journal, args.category, args.no_repeat,
+                      args.bots_after, args.bot_difficulty, args.bot_think_time)
+        register_server_metrics(lobby)
+        if args.bots_after:
+            # Index the keywords for bots in the background before one is needed
+            prepare_index(read_database(DATABASE_FILE))
+        if args.metrics_port:
+            await start_metrics_server("localhost", args.metrics_port + (slot or 0))
+        # Profiling on demand: SIGUSR1 (to this worker, or to the supervisor
+        # for all of them) toggles a window with the defaults, the control
+        # socket takes the full set of commands
+        profiler = Profiler(args.profile_dir)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.toggle)
+        control = None
+        if args.control_socket:
+            control = ControlServer(profiler, args.control_socket if slot is None else "{}.{}".format(args.control_socket, slot))
+            await control.start()
+        # SIGINT and SIGTERM stop accepting and fall through to the cleanup
+        # below, so buffered leaderboard rows and journal records are written
+        serving = asyncio.ensure_future(serve(host, port, lobby, args.max_outbound, args.overflow_policy,
+                                              reuse_port=stats_fd is not None, stats_fd=stats_fd,
+                                              max_inbound=max_inbound, input_rate=args.input_rate,
+                                              input_burst=args.input_burst))
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            print("Server shutting down (pid {})".format(os.getpid()))
+        finally:
+            profiler.stop()
+            if control is not None:
+                control.close()
+            if leaderboard is not None:
+                leaderboard.close()
+            if journal is not None:
+                journal.close()
+
+    def run_worker(slot=None, stats_fd=None):
+        asyncio.run(run_worker_async(slot, stats_fd))
+
+    if args.workers > 1:
+        Supervisor(args.workers, run_worker, registry_path).run()
+    else:
+        run_worker()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import resource
+import socket
+import sys
+from collections import deque
+from types import SimpleNamespace
+
+import loadgen
+from connection import DEFAULT_INPUT_RATE, Connection
+from server import GameRoom, Player
+
+# Soak check for long-lived rooms.
+# Runs one room in this process against simulated players that vote to play
+# again every time, and checks that resident memory stays flat as the rounds
+# add up. Exits with status 1 if memory grew by more than --max-growth.
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Peak rather than current size, but it still shows steady growth
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+async def soak(args):
+    room = GameRoom(1, args.players, 5)
+    room.timers.start()
+    results = loadgen.Results()
+    results.turn_latencies = deque(maxlen=1000)  # only the recent turns, or the check would measure itself
+    load_args = SimpleNamespace(strategy="random", think_time=0.0, games=args.rounds,
+                                max_rate=DEFAULT_INPUT_RATE)
+
+    simulated = []
+    for i in range(args.players):
+        ours, theirs = socket.socketpair()
+        room.players.append(Player(Connection(ours, None), None, "soak{}".format(i)))
+        player = loadgen.SimulatedPlayer(i, load_args, results)
+        player.reader, player.writer = await asyncio.open_connection(sock=theirs)
+        simulated.append(player)
+
+    tasks = [asyncio.create_task(room.run())] + [asyncio.create_task(player.play()) for player in simulated]
+    done = asyncio.gather(*tasks)
+
+    # Sample memory as the rounds go by; the first samples are the warm-up
+    samples = []
+    next_sample = args.warmup
+    while not done.done():
+        rounds = simulated[0].games_played
+        if rounds >= next_sample:
+            samples.append((rounds, rss_bytes()))
+            print("round {:>7}  rss {:>8.1f} MiB".format(rounds, samples[-1][1] / 2 ** 20))
+            next_sample += args.interval
+        await asyncio.sleep(0.05)
+    await done
+    for player in simulated:
+        player.writer.close()
+    samples.append((simulated[0].games_played, rss_bytes()))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a room rematching for many rounds runs in constant memory")
+    parser.add_argument("--rounds", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=2)
+    parser.add_argument("--warmup", type=int, default=500, help="rounds played before the baseline sample")
+    parser.add_argument("--interval", type=int, default=1000, help="rounds between samples")
+    parser.add_argument("--max-growth", type=float, default=2.0, help="allowed growth after the warm-up in MiB")
+    args = parser.parse_args()
+
+    samples = asyncio.run(soak(args))
+    rounds, final = samples[-1]
+    growth = (final - samples[0][1]) / 2 ** 20
+    print("Played {} rounds, memory grew {:.2f} MiB after the warm-up".format(rounds, growth))
+    if rounds < args.rounds or growth > args.max_growth:
+        print("FAILED")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
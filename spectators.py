@@ -0,0 +1,95 @@
+import asyncio
+
+from connection import OVERFLOW_DISCONNECT
+from protocol import MessageType, encode
+
+# Read-only audience of a room.
+# Every event is encoded once by the room and published here as an immutable
+# bytes object. The feed collects events for `interval` seconds and then hands
+# the whole batch to each spectator as one vectored send, so fan-out costs no
+# copies however many people watch. Fan-out runs in chunks with a yield to the
+# loop between them, and a spectator that cannot keep up is disconnected, so
+# a large audience never delays the players' own traffic.
+
+BATCH_INTERVAL = 0.05
+FAN_OUT_CHUNK = 256           # spectators served per loop iteration
+SPECTATOR_MAX_OUTBOUND = 16 * 1024
+MAX_BATCH_BUFFERS = 512       # stays well below IOV_MAX for sendmsg
+
+class SpectatorFeed:
+    def __init__(self, snapshot, interval=BATCH_INTERVAL, chunk=FAN_OUT_CHUNK):
+        self.snapshot = snapshot  # returns the SNAPSHOT fields for a newcomer
+        self.interval = interval
+        self.chunk = chunk
+        self.spectators = []
+        self._joining = []
+        self._pending = []
+        self._handle = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self.spectators) + len(self._joining)
+
+    # Newcomers are added at the next flush, after the snapshot of the room
+    # at that point, so they never see an event older than their snapshot
+    def add(self, conn):
+        conn.max_outbound = SPECTATOR_MAX_OUTBOUND
+        conn.overflow_policy = OVERFLOW_DISCONNECT
+        self._joining.append(conn)
+        self._schedule()
+
+    def publish(self, data):
+        if not self.spectators and not self._joining:
+            return
+        self._pending.append(data)
+        self._schedule()
+
+    def publish_message(self, msg_type, *fields):
+        if self.spectators or self._joining:
+            self.publish(encode(msg_type, *fields))
+
+    def _schedule(self):
+        if self._handle is None:
+            if self._loop is None:
+                self._loop = asyncio.get_running_loop()
+            self._handle = self._loop.call_later(self.interval, self.flush)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending = self._pending, []
+        if len(batch) > MAX_BATCH_BUFFERS:
+            batch = [b"".join(batch)]
+
+        self.spectators = [conn for conn in self.spectators if not conn.closed]
+        if batch and self.spectators:
+            self._fan_out(self.spectators, batch, 0)
+
+        if self._joining:
+            snapshot = encode(MessageType.SNAPSHOT, *self.snapshot())
+            for conn in self._joining:
+                conn.send(snapshot)
+            # A new list, the chunks still being fanned out keep the old one
+            self.spectators = self.spectators + self._joining
+            self._joining = []
+
+    def _fan_out(self, spectators, batch, start):
+        end = start + self.chunk
+        for conn in spectators[start:end]:
+            conn.send_buffers(batch)
+        if end < len(spectators):
+            self._loop.call_soon(self._fan_out, spectators, batch, end)
+
+    # Deliver what is left in one go, say goodbye and disconnect everyone
+    def close(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._pending.append(encode(MessageType.GAME_CLOSED))
+        batch, self._pending = [b"".join(self._pending)], []
+        for conn in self.spectators + self._joining:
+            conn.send_buffers(batch)
+            conn.close()
+        self.spectators = []
+        self._joining = []
@@ -0,0 +1,188 @@
+import errno
+import json
+import os
+import selectors
+import signal
+import time
+
+from registry import RegistryServer
+
+# Pre-fork supervisor for running the server on several cores.
+# Each worker is a forked process that runs its own event loop and accepts on
+# the shared port (SO_REUSEPORT), so the kernel spreads connections between
+# them. Workers report their stats as JSON lines over a pipe; the supervisor
+# restarts any worker that dies and periodically prints the totals. It also
+# hosts the shared nickname registry on a Unix socket. SIGUSR1 sent to the
+# supervisor is passed on to every worker (see profiling.py).
+
+RESTART_DELAY = 1.0  # minimum seconds between two starts of the same worker slot
+
+class Worker:
+    def __init__(self, slot):
+        self.slot = slot
+        self.pid = None
+        self.stats_fd = None
+        self.buffer = b""
+        self.stats = {}
+        self.started_at = 0.0
+
+# Send one stats snapshot from a worker to the supervisor. The pipe is
+# non-blocking so a supervisor that stops reading never stalls a worker.
+def report_stats(stats_fd, stats):
+    try:
+        os.write(stats_fd, json.dumps(stats).encode() + b"\n")
+    except BlockingIOError:
+        pass
+    except OSError as e:
+        if e.errno != errno.EPIPE:
+            raise
+
+def aggregate_stats(workers):
+    totals = {}
+    for worker in workers:
+        for key, value in worker.stats.items():
+            if isinstance(value, (int, float)) and key != "pid":
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+class Supervisor:
+    def __init__(self, num_workers, worker_main, registry_path, stats_interval=10.0):
+        self.workers = [Worker(slot) for slot in range(num_workers)]
+        self.worker_main = worker_main
+        self.stats_interval = stats_interval
+        self._selector = selectors.DefaultSelector()
+        self._running = True
+        self.registry_server = RegistryServer(registry_path)
+        self.registry_server.attach(self._selector)
+
+    def _spawn(self, worker):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child: drop the supervisor's side of every pipe and run the server
+            os.close(read_fd)
+            for other in self.workers:
+                if other.stats_fd is not None:
+                    os.close(other.stats_fd)
+            self.registry_server.close_inherited()
+            # Until the worker's loop takes over SIGINT and SIGTERM to shut
+            # down cleanly, either one just interrupts it
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)  # until the worker's profiler handles it
+            os.set_blocking(write_fd, False)
+            code = 0
+            try:
+                self.worker_main(worker.slot, write_fd)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        worker.pid = pid
+        worker.stats_fd = read_fd
+        worker.buffer = b""
+        worker.stats = {}
+        worker.started_at = time.monotonic()
+        self._selector.register(read_fd, selectors.EVENT_READ, worker)
+        print("Worker {} started with pid {}".format(worker.slot, pid))
+
+    def _read_stats(self, worker):
+        try:
+            data = os.read(worker.stats_fd, 65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self._close_pipe(worker)
+            return
+        lines = (worker.buffer + data).split(b"\n")
+        worker.buffer = lines.pop()
+        if lines:
+            worker.stats = json.loads(lines[-1])
+
+    def _close_pipe(self, worker):
+        if worker.stats_fd is not None:
+            self._selector.unregister(worker.stats_fd)
+            os.close(worker.stats_fd)
+            worker.stats_fd = None
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for worker in self.workers:
+                if worker.pid == pid:
+                    print("Worker {} (pid {}) exited with status {}".format(worker.slot, pid, os.waitstatus_to_exitcode(status)))
+                    worker.pid = None
+                    self._close_pipe(worker)
+
+    def _stop(self, signum, frame):
+        self._running = False
+
+    def _forward(self, signum, frame):
+        for worker in self.workers:
+            if worker.pid is not None:
+                try:
+                    os.kill(worker.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def print_stats(self):
+        alive = sum(1 for worker in self.workers if worker.pid is not None)
+        totals = aggregate_stats(self.workers)
+        print("Workers alive: {}/{} | {}".format(alive, len(self.workers),
+              ", ".join("{}: {}".format(key, value) for key, value in sorted(totals.items()))))
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGUSR1, self._forward)
+        for worker in self.workers:
+            self._spawn(worker)
+
+        next_report = time.monotonic() + self.stats_interval
+        while self._running:
+            for key, events in self._selector.select(timeout=0.5):
+                if callable(key.data):
+                    key.data(events)
+                else:
+                    self._read_stats(key.data)
+            self._reap()
+
+            now = time.monotonic()
+            for worker in self.workers:
+                # Restart dead workers, but not in a tight loop if they crash on start
+                if worker.pid is None and self._running and now - worker.started_at >= RESTART_DELAY:
+                    self._spawn(worker)
+            if now >= next_report:
+                self.print_stats()
+                next_report = now + self.stats_interval
+
+        self.shutdown()
+
+    def shutdown(self):
+        for worker in self.workers:
+            if worker.pid is not None:
+                try:
+                    os.kill(worker.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for worker in self.workers:
+            if worker.pid is not None:
+                try:
+                    os.waitpid(worker.pid, 0)
+                except ChildProcessError:
+                    pass
+                worker.pid = None
+            self._close_pipe(worker)
+        self.registry_server.close()
+        self._selector.close()
@@ -0,0 +1,96 @@
+import asyncio
+
+# Hashed timing wheel for the server's deadlines (turns, restart votes).
+# Timers are hashed into one of `slots` buckets by their expiry tick, so
+# scheduling and cancelling are O(1) no matter how many rooms are waiting.
+# The wheel advances on the event loop every `tick` seconds and runs expired
+# callbacks there, so a timeout is just another event on the loop. Like the
+# loop's own callbacks, one that raises is reported to the loop's exception
+# handler and the rest still run.
+
+class Timer:
+    __slots__ = ("callback", "rounds", "slot", "wheel")
+
+    def __init__(self, wheel, slot, rounds, callback):
+        self.wheel = wheel
+        self.slot = slot
+        self.rounds = rounds
+        self.callback = callback
+
+    def cancel(self):
+        if self.wheel is not None:
+            self.wheel._slots[self.slot].discard(self)
+            self.wheel._count -= 1
+            self.wheel = None
+
+    def active(self):
+        return self.wheel is not None
+
+class TimerWheel:
+    def __init__(self, tick=0.1, slots=1024):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._position = 0  # slot of the tick being processed next
+        self._count = 0
+        self._loop = None
+        self._handle = None
+        self._next_time = 0.0
+
+    def __len__(self):
+        return self._count
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._next_time = self._loop.time() + self.tick
+        self._handle = self._loop.call_at(self._next_time, self._advance)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    # Run callback() once `delay` seconds have passed, give or take one tick
+    def schedule(self, delay, callback):
+        ticks = max(1, int(-(-delay // self.tick)))
+        slot = (self._position + ticks - 1) % len(self._slots)
+        timer = Timer(self, slot, (ticks - 1) // len(self._slots), callback)
+        self._slots[slot].add(timer)
+        self._count += 1
+        return timer
+
+    def _advance(self):
+        now = self._loop.time()
+        # Catch up on every tick that has passed, even if the loop was busy.
+        # Move on first, so a callback that schedules a timer counts from
+        # the next tick and not from the slot being emptied, and so the next
+        # tick is due whatever the callbacks do.
+        due = []
+        while self._next_time <= now:
+            due.append(self._slots[self._position])
+            self._position = (self._position + 1) % len(self._slots)
+            self._next_time += self.tick
+        self._handle = self._loop.call_at(self._next_time, self._advance)
+        for bucket in due:
+            self._expire(bucket)
+
+    def _expire(self, bucket):
+        if not bucket:
+            return
+        expired = []
+        for timer in bucket:
+            if timer.rounds:
+                timer.rounds -= 1
+            else:
+                expired.append(timer)
+        for timer in expired:
+            bucket.discard(timer)
+            self._count -= 1
+            timer.wheel = None
+        for timer in expired:
+            try:
+                timer.callback()
+            except Exception as e:
+                self._loop.call_exception_handler({
+                    "message": "Exception in timer callback {!r}".format(timer.callback),
+                    "exception": e,
+                })